@@ -1,26 +1,228 @@
 import sys
+from time import perf_counter
+START_TIME = perf_counter() # for measuring how long startup takes
+STARTUP_BUDGET = 1.0 # seconds from launch until the window is shown
 from PySide2 import QtCore, QtGui, QtWidgets
 from PySide2.QtWidgets import *
 from PySide2.QtCore import Qt, QTimer
 from importlib import import_module
 from pprint import pprint
-
-class Canvas(QLabel):
-    ''' The canvas, on which any model loaded by the application will draw. '''
+from random import randint
+from objects.worker import RenderWorker, ExportWorker, GalleryWorker
+from objects.recorder import Recorder
+from objects.cache import RenderCache
+from objects.profiler import profiler
+from objects.quality import QualityController
+from objects.geometry import Geometry
+
+# blend modes offered for layers, and the QPainter composition modes for them
+BLEND_MODES = {"Normal": QtGui.QPainter.CompositionMode_SourceOver,
+    "Multiply": QtGui.QPainter.CompositionMode_Multiply,
+    "Screen": QtGui.QPainter.CompositionMode_Screen,
+    "Overlay": QtGui.QPainter.CompositionMode_Overlay,
+    "Darken": QtGui.QPainter.CompositionMode_Darken,
+    "Lighten": QtGui.QPainter.CompositionMode_Lighten,
+    "Difference": QtGui.QPainter.CompositionMode_Difference,
+    "Exclusion": QtGui.QPainter.CompositionMode_Exclusion,
+    "Add": QtGui.QPainter.CompositionMode_Plus}
+
+class Layer:
+    ''' One model's drawing, on a transparent image the size of the canvas,
+    with the opacity and blend mode it is composited with. '''
+    opacity = 1.0 # defaults for new layers
+    blend = "Normal"
+
+    def __init__(self, size):
+        self.image = QtGui.QImage(size, QtGui.QImage.Format_ARGB32_Premultiplied)
+        self.image.fill(Qt.transparent)
+
+class Canvas(QWidget):
+    ''' The canvas, on which any model loaded by the application will draw.
+
+    Each model draws on its own layer, and the layers are composited, in the
+    order they were first drawn on, over the background into a QImage raster
+    buffer. Redrawing one model only changes its layer, and changing a
+    layer's opacity or blend mode (or the background) only composites the
+    layers again, without redrawing any of them.
+
+    Changes are recorded as dirty rectangles and coalesced into at most one
+    update per frame interval, and only the dirty region is composited and
+    painted on screen. It can also show a heads-up display of frames per
+    second and the profiler's measurements on top. '''
     def __init__(self, screen_res):
         super().__init__()
         self.bg_color = Qt.white
         self.colors = {"White": "#FFFFFF", "Light gray": "#DDDDDD", "Dark gray": "#222222", "Black": "#000000"}
         w, h = screen_res.width(), screen_res.height()
         self.w, self.h = w * .6, h * .6
-        pixmap = QtGui.QPixmap(self.w, self.h)
-        pixmap.fill(self.bg_color)
-        self.setPixmap(pixmap)
+        self.image = QtGui.QImage(int(self.w), int(self.h), QtGui.QImage.Format_ARGB32_Premultiplied)
+        self.image.fill(self.bg_color)
+        self.layers = {} # Layer for each model name, bottom first
+        self.setFixedSize(self.image.size())
+        self.setAttribute(Qt.WA_OpaquePaintEvent) # paintEvent covers what it updates
+
+        self.dirty = QtGui.QRegion() # area changed since the last update
+        self.update_timer = QTimer(self)
+        self.update_timer.setSingleShot(True)
+        self.update_timer.setInterval(16) # about one update per vsync
+        self.update_timer.timeout.connect(self.flush)
+
+        self.hud = False # whether the heads-up display is shown
+        lines = self.fontMetrics().lineSpacing()
+        self.hud_rect = QtCore.QRect(8, 8, 420, 5 * lines + 8) # FPS and summary
+        self.hud_timer = QTimer(self)
+        self.hud_timer.setInterval(250)
+        self.hud_timer.timeout.connect(self.refresh_hud)
+        self.frames = 0 # frames swapped in since the last HUD refresh
+        self.fps = 0
+        self.fps_time = perf_counter()
+
+    def layer(self, name):
+        ''' Returns the named layer, adding it on top if it is new. '''
+        if name not in self.layers:
+            self.layers[name] = Layer(self.image.size())
+        return self.layers[name]
 
     def clear(self):
-        ''' Clears and updates the canvas. '''
-        self.pixmap().fill(self.bg_color)
-        self.update()
+        ''' Removes all layers, and updates the canvas. '''
+        self.layers = {}
+        self.composite(self.image.rect())
+
+    def clear_layer(self, name):
+        ''' Clears one layer, keeping its place, opacity and blend mode. '''
+        if name in self.layers:
+            self.layers[name].image.fill(Qt.transparent)
+            self.composite(self.image.rect())
+
+    def swap(self, name, image, rect):
+        ''' Copies an area drawn off-screen by a render worker into the named
+        layer at the given rectangle, and composites that area again. This
+        is the only drawing the GUI thread does for a model. '''
+        start = perf_counter() if profiler.enabled else None
+        p = QtGui.QPainter(self.layer(name).image)
+        p.setCompositionMode(QtGui.QPainter.CompositionMode_Source)
+        p.drawImage(rect.topLeft(), image)
+        p.end()
+        self.frames += 1
+        self.composite(rect)
+        if start is not None:
+            profiler.add("swap", start)
+
+    def composite(self, rect):
+        ''' Draws the background and every layer into the canvas buffer,
+        within the rectangle, and marks it dirty. '''
+        p = QtGui.QPainter(self.image)
+        p.fillRect(rect, self.bg_color)
+        for layer in self.layers.values():
+            p.setCompositionMode(BLEND_MODES[layer.blend])
+            p.setOpacity(layer.opacity)
+            p.drawImage(rect.topLeft(), layer.image, rect)
+        p.end()
+        self.mark_dirty(rect)
+
+    def mark_dirty(self, rect):
+        ''' Adds a rectangle to the dirty region, and schedules an update if
+        one is not already pending. '''
+        self.dirty += rect
+        if not self.update_timer.isActive():
+            self.update_timer.start()
+
+    def flush(self):
+        ''' Requests a repaint of everything marked dirty since the last one. '''
+        self.update(self.dirty)
+        self.dirty = QtGui.QRegion()
+
+    def paintEvent(self, event):
+        ''' Paints only the parts of the buffer which need it, and the
+        heads-up display if it is shown. '''
+        start = perf_counter() if profiler.enabled else None
+        p = QtGui.QPainter(self)
+        for rect in event.region().rects():
+            p.drawImage(rect, self.image, rect)
+        if self.hud and event.region().intersects(self.hud_rect):
+            self.draw_hud(p)
+        p.end()
+        if start is not None:
+            profiler.add("repaint", start)
+
+    def show_hud(self, shown):
+        ''' Shows or hides the heads-up display. The profiler runs while it is
+        shown. '''
+        self.hud = shown
+        if shown:
+            profiler.start()
+            self.fps_time, self.frames = perf_counter(), 0
+            self.hud_timer.start()
+        else:
+            profiler.stop()
+            self.hud_timer.stop()
+        self.update(self.hud_rect)
+
+    def refresh_hud(self):
+        ''' Works out the frame rate since the last refresh, and repaints the
+        heads-up display, resized to fit. '''
+        now = perf_counter()
+        self.fps = self.frames / (now - self.fps_time)
+        self.fps_time, self.frames = now, 0
+        self.update(self.hud_rect)
+        # fit the width to the text, which grows with the numbers in it
+        fm = self.fontMetrics()
+        lines = ["%.0f FPS" % self.fps] + profiler.summary()
+        self.hud_rect.setWidth(max(fm.horizontalAdvance(line) for line in lines) + 12)
+        self.update(self.hud_rect)
+
+    def draw_hud(self, p):
+        p.fillRect(self.hud_rect, QtGui.QColor(0, 0, 0, 160))
+        p.setPen(Qt.white)
+        step = p.fontMetrics().lineSpacing()
+        x, y = self.hud_rect.x() + 6, self.hud_rect.y() + 4 + p.fontMetrics().ascent()
+        for i, line in enumerate(["%.0f FPS" % self.fps] + profiler.summary()):
+            p.drawText(x, y + i * step, line)
+
+class Gallery(QDialog):
+    ''' A window of thumbnails of randomized designs for a model. Each design
+    gets a new seed, and the thumbnails are drawn in a pool of processes and
+    added to the grid as they finish. Clicking one emits "chosen" with the
+    exact parameters it was drawn with. '''
+    chosen = QtCore.Signal(object)
+
+    def __init__(self, parent, model, canvas, count = 16, columns = 4, thumb_width = 240):
+        super().__init__(parent)
+        self.setWindowTitle("Gallery")
+        self.columns = columns
+        self.count = 0 # thumbnails shown so far
+        self.grid = QGridLayout()
+        self.setLayout(self.grid)
+        # every design starts from the current settings, so settings which
+        # are not randomized (like the color map) carry over
+        params = model.get_params()
+        bg_color = QtGui.QColor(canvas.bg_color).name()
+        jobs = [{"model": type(model).__name__, "params": params,
+            "seed": randint(0, 99999999), "width": canvas.w, "height": canvas.h,
+            "scale": thumb_width / canvas.w, "background": bg_color} for i in range(count)]
+        self.worker = GalleryWorker(jobs)
+        self.worker.thumbnail_ready.connect(self.add_thumbnail, Qt.QueuedConnection)
+        self.worker.start()
+
+    def add_thumbnail(self, job, params, image):
+        ''' Adds a finished thumbnail to the next place in the grid. '''
+        button = QToolButton()
+        button.setIcon(QtGui.QIcon(QtGui.QPixmap.fromImage(image)))
+        button.setIconSize(image.size())
+        button.setToolTip("Seed %i" % job["seed"])
+        button.clicked.connect(lambda: self.choose(params))
+        self.grid.addWidget(button, self.count // self.columns, self.count % self.columns)
+        self.count += 1
+
+    def choose(self, params):
+        self.chosen.emit(params)
+        self.accept()
+
+    def done(self, result):
+        ''' Stops the thumbnails still being drawn when the window closes. '''
+        self.worker.cancel()
+        self.worker.wait()
+        super().done(result)
 
 class MainWindow(QMainWindow):
     ''' The main application window, which manages the canvas, keeps track of
@@ -30,12 +232,20 @@ class MainWindow(QMainWindow):
         super().__init__()
 
         self.canvas = Canvas(screen_res)
-        self.model_names = ["None selected", "Branch", "Conway", "Harmonograph", "Heatmap", "Transform"]
-        self.models = self.load_models() # model classes
-        self.menus = self.load_menus() # dict of widgets for each model
+        self.model_names = ["None selected", "Branch", "Conway", "Harmonograph", "Heatmap", "Transform", "Geometry"]
+        self.models = {} # model objects, created when first selected
+        self.menus = {} # dict of settings widgets for each loaded model
         self.curr_model = "None selected"
         self.model = None # Model object
         self.model_params = {} # settings for the model to run (not used)
+        self.job_id = 0 # number of the latest render
+        self.layer_jobs = {} # current render of each layer; others are stale
+        self.workers = [] # render threads which have not finished yet
+        self.exporter = None # thread running a high-resolution export
+        self.gallery = None # window of randomized designs, if open
+        self.cache = RenderCache() # finished renders, by model parameters
+        self.quality = QualityController() # scales down previews
+        self.preview = False # whether Go! draws a preview within the budget
 
         main_w = QWidget() # create a widget to contain canvas and all controls
         main_l = QHBoxLayout()
@@ -44,6 +254,7 @@ class MainWindow(QMainWindow):
         control_l = QVBoxLayout() # layout for canvas & overall controls
         buttons_l = QHBoxLayout() # layout for main control buttons, under control_l
         model_l = QVBoxLayout() # layout for model-specific controls
+        self.model_l = model_l
 
         # create layout for choosing model and color scheme
         choose_model_l = QGridLayout()
@@ -57,10 +268,26 @@ class MainWindow(QMainWindow):
         color_drop.activated[str].connect(self.change_color)
         color_label = QLabel("Canvas:")
 
+        # opacity and blend mode of the current model's layer
+        self.opacity_box = QSpinBox()
+        self.opacity_box.setRange(0, 100)
+        self.opacity_box.setSuffix("%")
+        self.opacity_box.setValue(100)
+        self.opacity_box.valueChanged.connect(self.set_opacity)
+        opacity_label = QLabel("Layer opacity:")
+
+        self.blend_drop = QComboBox()
+        self.blend_drop.addItems(list(BLEND_MODES))
+        self.blend_drop.activated[str].connect(self.set_blend)
+        blend_label = QLabel("Layer blend:")
+
         # create control buttons
         random_b = QPushButton('Randomize')
         random_b.clicked.connect(self.on_randomize)
 
+        gallery_b = QPushButton('Gallery')
+        gallery_b.clicked.connect(self.on_gallery)
+
         restart_b = QPushButton('Restart clock')
         restart_b.clicked.connect(self.on_restart)
 
@@ -73,6 +300,20 @@ class MainWindow(QMainWindow):
         save_b = QPushButton('Save')
         save_b.clicked.connect(self.save_image)
 
+        export_b = QPushButton('Export')
+        export_b.clicked.connect(self.export_image)
+
+        record_b = QPushButton('Record')
+        record_b.clicked.connect(self.on_record)
+
+        preview_b = QPushButton('Preview')
+        preview_b.setCheckable(True)
+        preview_b.toggled.connect(self.set_preview)
+
+        stats_b = QPushButton('Stats')
+        stats_b.setCheckable(True)
+        stats_b.toggled.connect(self.canvas.show_hud)
+
         go_b = QPushButton('Go!')
         go_b.clicked.connect(self.on_go)
 
@@ -88,17 +329,22 @@ class MainWindow(QMainWindow):
         choose_model_l.addWidget(model_drop, 0, 1)
         choose_model_l.addWidget(color_label, 1, 0)
         choose_model_l.addWidget(color_drop, 1, 1)
-
-        # add widgets for individual models
-        for widget in self.menus.values():
-            model_l.addWidget(widget)
+        choose_model_l.addWidget(opacity_label, 2, 0)
+        choose_model_l.addWidget(self.opacity_box, 2, 1)
+        choose_model_l.addWidget(blend_label, 3, 0)
+        choose_model_l.addWidget(self.blend_drop, 3, 1)
 
         # add buttons to controls
         buttons_l.addWidget(random_b)
+        buttons_l.addWidget(gallery_b)
         buttons_l.addWidget(restart_b)
         buttons_l.addWidget(reset_b)
         buttons_l.addWidget(clear_b)
         buttons_l.addWidget(save_b)
+        buttons_l.addWidget(export_b)
+        buttons_l.addWidget(record_b)
+        buttons_l.addWidget(preview_b)
+        buttons_l.addWidget(stats_b)
         buttons_l.addWidget(go_b)
 
         self.setCentralWidget(main_w)
@@ -106,8 +352,17 @@ class MainWindow(QMainWindow):
         self.change_widget()
 
     def clear_screen(self):
-        ''' Clears the canvas. '''
+        ''' Stops any render in progress and clears the canvas, removing
+        every layer. '''
+        self.cancel_render()
         self.canvas.clear()
+        self.sync_layer_controls()
+
+    def clear_layer(self):
+        ''' Stops the current model's render, if any, and clears its layer.
+        '''
+        self.cancel_render(self.curr_model)
+        self.canvas.clear_layer(self.curr_model)
 
     def on_restart(self):
         ''' Restarts model at depth 0 (how far it is in drawing). This will
@@ -118,6 +373,7 @@ class MainWindow(QMainWindow):
 
     def on_reset(self):
         ''' Resets all customizable settings for the current model. '''
+        self.cancel_render(self.curr_model)
         if self.model is not None:
             self.model.reset()
 
@@ -129,73 +385,228 @@ class MainWindow(QMainWindow):
         except:
             print("This model cannot be randomized.")
 
+    def on_gallery(self):
+        ''' Opens a gallery of randomized designs of the current model, if the
+        model can be randomized from a seed. Choosing one loads it into the
+        model and draws it. '''
+        if not hasattr(self.model, "randomize_params"):
+            print("This model has no gallery.")
+            return
+        if self.gallery is not None:
+            self.gallery.close()
+        self.gallery = Gallery(self, self.model, self.canvas)
+        self.gallery.chosen.connect(self.load_design)
+        self.gallery.finished.connect(self.forget_gallery)
+        self.gallery.show()
+
+    def forget_gallery(self):
+        self.gallery = None
+
+    def load_design(self, params):
+        ''' Loads parameters chosen in the gallery into the current model, and
+        draws it. '''
+        self.cancel_render(self.curr_model)
+        self.model.set_params(params)
+        self.model.sync_menu()
+        self.on_go()
+
     def on_go(self):
-        ''' Restarts the drawing progress of the current model, clears the
-        canvas, and starts the model generating/drawing. '''
+        ''' Restarts the drawing progress of the current model, clears its
+        layer, and starts the model generating/drawing. The layers of other
+        models are left as they are. '''
         if self.model is not None:
             print("Go!")
+            if profiler.enabled: # measure each drawing on its own
+                profiler.reset()
             self.on_restart()
-            self.clear_screen()
-            self.model.go()
+            self.clear_layer()
+            self.start_render()
         else:
             print("No model selected!")
 
+    def set_preview(self, preview):
+        ''' Turns previews on or off. While they are on, Go! draws as much of
+        the drawing as fits in the quality controller's time budget. Export,
+        Record and the gallery always draw in full. '''
+        self.preview = preview
+
+    def on_record(self):
+        ''' Like Go!, but also records the drawing as an animation, to an
+        animated PNG or (for a file name like "frames/tree%05d.png") a
+        sequence of images. '''
+        if self.model is None:
+            print("No model selected!")
+            return
+        file_name, _ = QFileDialog.getSaveFileName(self, "Record Animation", "", "Animated PNG (*.png *.apng);;Frame sequence (*%*)")
+        if file_name:
+            self.on_restart()
+            self.clear_layer()
+            self.start_render(Recorder(file_name, background = self.canvas.bg_color))
+
+    def start_render(self, recorder = None):
+        ''' Starts a worker thread which draws the current model off-screen and
+        hands its frames back to the model's layer of the canvas (and to the
+        recorder, if any). Layers are drawn on a transparent background; the
+        recorder lays the canvas background under its own frames.
+        If the same parameters have been rendered before, the cached image is
+        shown straight away instead, unless the drawing is being recorded.
+        If only the drawing's geometry is cached (say, by render.py on
+        another background), it is painted from there without generating
+        it. Otherwise, in preview mode, the model may be drawn at
+        lower quality, and a full drawing's geometry is saved to the cache.
+        '''
+        c = self.canvas
+        model = self.model
+        bg_color = Qt.transparent
+        key = model.cache_key(c.w, c.h, bg_color)
+        geometry_key = model.geometry_key(c.w, c.h)
+        if recorder is None:
+            image = self.cache.get(key)
+            if image is not None:
+                print("Loaded from cache")
+                c.swap(self.curr_model, image, image.rect())
+                return
+            file_name = self.cache.get_geometry(geometry_key)
+            if file_name is not None:
+                print("Drawing from cached geometry")
+                model = Geometry(c)
+                model.set_params(dict(Geometry.defaults, file_name = file_name))
+                geometry_key = None
+            elif self.preview:
+                model, fraction = self.quality.preview(model)
+                if fraction < 1:
+                    print("Previewing about %.0f%% of the drawing" % (100 * fraction))
+                    key = geometry_key = None # not the full drawing, so not cached
+        self.job_id += 1
+        self.layer_jobs[self.curr_model] = self.job_id
+        worker = RenderWorker(self.job_id, model, c.w, c.h, bg_color, recorder, self.cache, key, self.quality, geometry_key)
+        worker.layer = self.curr_model
+        worker.frame_ready.connect(self.on_frame, Qt.QueuedConnection)
+        worker.finished.connect(self.reap_workers)
+        self.workers.append(worker)
+        worker.start()
+
+    def cancel_render(self, layer = None):
+        ''' Supersedes the render in progress on a layer, or on every layer.
+        Its frames will be dropped, and its thread stops at the next
+        primitive it draws. '''
+        for worker in self.workers:
+            if layer is None or worker.layer == layer:
+                worker.cancel()
+        if layer is None:
+            self.layer_jobs = {}
+        else:
+            self.layer_jobs.pop(layer, None)
+
+    def on_frame(self, job_id, image, rect):
+        ''' Receives a newly drawn area from a render worker, and shows it on
+        its layer of the canvas unless a newer render has started since. '''
+        for name, job in self.layer_jobs.items():
+            if job == job_id:
+                self.canvas.swap(name, image, rect)
+                break
+
+    def reap_workers(self):
+        ''' Forgets about worker threads which have finished running. '''
+        self.workers = [w for w in self.workers if not w.isFinished()]
+
     def save_image(self):
         ''' Opens a file saving dialog and saves the current canvas image to the
         chosen file. '''
         options = QFileDialog.Options()
         file_name, _ = QFileDialog.getSaveFileName(self,"Save File","","Image files (*.jpeg *.jpg *.gif *.png *.JPEG *.JPG *.GIF *.PNG)", options=options)
         if file_name:
-            pixels = self.canvas.pixmap()
-            s = pixels.save(file_name)
+            s = self.canvas.image.save(file_name)
         if s:
             print("Image saved as %s" % file_name)
         else:
             print("Error saving %s" % file_name)
 
-    def load_models(self):
-        ''' For each model name listed in the __init__ method of this class,
-        the model is imported from the "objects" folder and an instance of it is
-        created. The same instances will be reused throughout the program, and
+    def export_image(self):
+        ''' Asks for a scale factor and a file, then re-renders the current
+        model at that scale in the background, tile by tile, so images far
+        bigger than the screen (or memory) can be saved. SVG files are
+        written as vector drawings instead, and .geo files as geometry which
+        the Geometry model can draw again. '''
+        if self.model is None:
+            print("No model selected!")
+            return
+        if self.exporter is not None:
+            print("An export is already running.")
+            return
+        scale, ok = QInputDialog.getDouble(self, "Export", "Scale factor:", 4, 0.1, 100, 1)
+        if not ok:
+            return
+        file_name, _ = QFileDialog.getSaveFileName(self, "Export File", "", "Image files (*.png *.tif *.tiff *.svg *.PNG *.TIF *.TIFF *.SVG);;Geometry files (*.geo)")
+        if not file_name:
+            return
+        c = self.canvas
+        self.exporter = ExportWorker(self.model, c.w, c.h, file_name, scale, c.bg_color)
+        self.export_progress = QProgressDialog("Exporting %s..." % file_name, "Cancel", 0, 1, self)
+        self.export_progress.setMinimumDuration(0)
+        self.export_progress.canceled.connect(self.exporter.cancel)
+        self.exporter.progress.connect(self.on_export_progress, Qt.QueuedConnection)
+        self.exporter.done.connect(self.on_export_done, Qt.QueuedConnection)
+        self.exporter.start()
+
+    def on_export_progress(self, done, total):
+        self.export_progress.setMaximum(total)
+        self.export_progress.setValue(done)
+
+    def on_export_done(self, error):
+        ''' Reports the end of an export, and forgets its thread. '''
+        file_name = self.exporter.export.file_name
+        self.exporter.wait()
+        self.exporter = None
+        self.export_progress.reset()
+        if error:
+            print("Error exporting %s: %s" % (file_name, error))
+        else:
+            print("Image exported as %s" % file_name)
+
+    def load_model(self, name):
+        ''' The first time a model is selected, it is imported from the
+        "objects" folder, an instance of it is created, and its settings panel
+        is built. The same instance will be reused throughout the program, and
         the "model" attribute of this class will indicate which one is in use.
-        '''
-        models = {}
-        for name in self.model_names:
+        Models are loaded this way so startup only pays for the ones used. '''
+        if name == "None selected":
+            return None
+        if name not in self.models:
             try:
                 ModelClass = getattr(import_module("objects." + name.lower()), name)
-                models[name] = ModelClass(self.canvas)
+                self.models[name] = ModelClass(self.canvas)
             except:
-                models[name] = None
+                self.models[name] = None
                 print("Could not import %s" % name)
-        return models
-
-    def load_menus(self):
-        ''' For each model name listed in the __init__ method of this class,
-        a QWidget is created. Then, the init_menu_layout function is called on
-        the model to set the layout (buttons, text, controls) of the widget for
-        that model. If the model was not imported successfully or does not have
-        an init_menu_layout function, an empty panel will be displayed. '''
-        menus = {}
-        for name in self.model_names:
-            widget = QWidget()
-            menus[name] = widget
-            try:
-                model = self.models[name]
-                widget.setLayout(model.init_menu_layout())
-            except:
-                empty = QVBoxLayout()
-                empty.addWidget(QLabel("No settings found"))
-                widget.setLayout(empty)
-                print("No settings menu found for model %s" % name)
-        return menus
+            self.menus[name] = self.load_menu(name)
+            self.model_l.addWidget(self.menus[name])
+        return self.models[name]
+
+    def load_menu(self, name):
+        ''' A QWidget is created for the model, and the init_menu_layout
+        function is called on the model to set the layout (buttons, text,
+        controls) of the widget. If the model was not imported successfully or
+        does not have an init_menu_layout function, an empty panel will be
+        displayed. '''
+        widget = QWidget()
+        try:
+            widget.setLayout(self.models[name].init_menu_layout())
+        except:
+            empty = QVBoxLayout()
+            empty.addWidget(QLabel("No settings found"))
+            widget.setLayout(empty)
+            print("No settings menu found for model %s" % name)
+        return widget
 
     def change_model(self, model_name):
         ''' Changes the current active model according to the name selected, and
         updated the model-specific settings display. '''
         print("Model changed to %s" % model_name)
         self.curr_model = model_name
-        self.model = self.models.get(model_name, None)
+        self.model = self.load_model(model_name)
         self.change_widget()
+        self.sync_layer_controls()
 
     def change_widget(self):
         ''' Looks through the dictionary of model names and setting panel
@@ -209,10 +620,43 @@ class MainWindow(QMainWindow):
 
     def change_color(self, name):
         ''' Changes the canvas' background color according to the drop-down
-        selection, and clears the canvas to update it. '''
+        selection. The layers are composited over the new color without being
+        redrawn. '''
         c = self.canvas.colors[name]
         self.canvas.bg_color = QtGui.QColor(c)
-        self.clear_screen()
+        self.canvas.composite(self.canvas.image.rect())
+
+    def set_opacity(self, percent):
+        ''' Changes the opacity of the current model's layer. '''
+        if self.model is not None:
+            self.canvas.layer(self.curr_model).opacity = percent / 100
+            self.canvas.composite(self.canvas.image.rect())
+
+    def set_blend(self, blend):
+        ''' Changes the blend mode of the current model's layer. '''
+        if self.model is not None:
+            self.canvas.layer(self.curr_model).blend = blend
+            self.canvas.composite(self.canvas.image.rect())
+
+    def sync_layer_controls(self):
+        ''' Sets the layer controls to the current model's layer settings. '''
+        layer = self.canvas.layers.get(self.curr_model, Layer) # Layer has the defaults
+        self.opacity_box.blockSignals(True)
+        self.opacity_box.setValue(round(layer.opacity * 100))
+        self.opacity_box.blockSignals(False)
+        self.blend_drop.setCurrentText(layer.blend)
+
+    def closeEvent(self, event):
+        ''' Stops any renders in progress before the window closes. '''
+        if self.gallery is not None:
+            self.gallery.close()
+        self.cancel_render()
+        for worker in self.workers:
+            worker.wait()
+        if self.exporter is not None:
+            self.exporter.cancel()
+            self.exporter.wait()
+        event.accept()
 
 if __name__ == "__main__":
 
@@ -220,4 +664,14 @@ if __name__ == "__main__":
     screen_res = app.desktop().screenGeometry() # get screen size
     window = MainWindow(screen_res) # create the main window
     window.show() # display the window
+
+    if "--startup-time" in sys.argv:
+        # once the window is up, report how long that took and quit; the exit
+        # status is nonzero if startup went over budget
+        def report_startup():
+            startup = perf_counter() - START_TIME
+            print("Startup took %.3f s (budget %.3f s)" % (startup, STARTUP_BUDGET))
+            app.exit(0 if startup <= STARTUP_BUDGET else 1)
+        QTimer.singleShot(0, report_startup)
+
     sys.exit(app.exec_()) # run the main event loop
@@ -0,0 +1,210 @@
+''' Benchmarks the generation and drawing of the models, without a window.
+
+Run every benchmark and save the results:
+
+    python bench.py -o baseline.json
+
+Then, after changing something, run them again and compare:
+
+    python bench.py --compare baseline.json
+
+Each case runs a model twice (keeping the best of --repeat runs of each):
+once on a surface which only counts the primitives, which times the model's
+own work (geometry math, color lookups) and nothing else, and once on a real
+Surface, presenting frames like the app does. The difference is the cost of
+painting. Rates are given as nodes/s (Branch circles), segments/s (lines)
+and primitives/s, and the time the GUI thread spends on each frame (copying
+the dirty area and drawing it into a canvas-sized image) as ms/frame.
+
+The comparison flags every time which got slower than the baseline by more
+than --threshold (10% by default), and exits with status 1 if any did.
+Conway and Heatmap do not generate anything yet, so they have no cases. '''
+import os
+import sys
+import json
+import argparse
+import platform
+import tempfile
+from time import perf_counter
+from importlib import import_module
+
+# draw on an off-screen platform, so no display is needed
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+from PySide2 import __version__ as pyside_version
+from PySide2.QtGui import QGuiApplication, QImage, QPainter, QColor
+from objects.surface import Surface
+from objects.export import GeometryExport
+
+# (model, case name, parameters, canvas width, canvas height)
+CASES = [
+    ("Branch", "depth 6", {"seed": 1, "max_depth": 6}, 1152, 648),
+    ("Branch", "depth 9", {"seed": 1, "max_depth": 9}, 1152, 648),
+    ("Branch", "depth 12", {"seed": 1, "max_depth": 12, "num_children": 2, "branch_prob": .9}, 1152, 648),
+    ("Branch", "depth 9 at 1920x1080", {"seed": 1, "max_depth": 9}, 1920, 1080),
+    ("Harmonograph", "640x360", {"amp1": 150, "amp3": 150}, 640, 360),
+    ("Harmonograph", "1152x648", {}, 1152, 648),
+    ("Harmonograph", "1920x1080", {"amp1": 500, "amp3": 500, "pen_size": 8}, 1920, 1080),
+    # a geometry file of the "depth 12" tree, drawn again
+    ("Geometry", "Branch depth 12", {"seed": 1, "max_depth": 12, "num_children": 2, "branch_prob": .9}, 1152, 648),
+]
+
+# times compared against the baseline; bigger is worse for all of them
+TIMES = ["compute_s", "paint_s", "total_s", "frame_ms"]
+
+class CountingSurface:
+    ''' A drawing target which only counts the primitives it is given. '''
+    def __init__(self, w, h):
+        self.w, self.h = w, h
+        self.lines = 0
+        self.circles = 0
+
+    def line(self, x1, y1, x2, y2, color, width = 1, depth = 0, index = 0):
+        self.lines += 1
+
+    def circle(self, x, y, r, color, depth = 0, index = 0):
+        self.circles += 1
+
+class FrameTimer:
+    ''' A present function which draws each frame into a canvas-sized image,
+    like Canvas.swap does, and times every frame. '''
+    def __init__(self, w, h):
+        self.image = QImage(w, h, QImage.Format_ARGB32_Premultiplied)
+        self.frames = 0
+        self.seconds = 0 # spent in present(), including this
+
+    def present(self, image, rect):
+        p = QPainter(self.image)
+        p.setCompositionMode(QPainter.CompositionMode_Source)
+        p.drawImage(rect.topLeft(), image)
+        p.end()
+        self.frames += 1
+
+def make_model(name, params, surface, geometry_file):
+    ''' Creates a model drawing on the surface, with default parameters
+    updated from params. A Geometry case draws a file made from a Branch with
+    those parameters instead. '''
+    if name == "Geometry":
+        model = getattr(import_module("objects.geometry"), name)(surface)
+        model.set_params(model.defaults)
+        model.set_params({"file_name": geometry_file})
+        return model
+    model = getattr(import_module("objects." + name.lower()), name)(surface)
+    model.set_params(model.defaults)
+    model.set_params(params)
+    return model
+
+def timed_present(surface, timer):
+    ''' Wraps the surface's present method so the time spent in it (the
+    copy of the dirty area, and drawing it into the canvas) is measured. '''
+    present = surface.present
+    def wrapper():
+        start = perf_counter()
+        present()
+        timer.seconds += perf_counter() - start
+    surface.present = wrapper
+
+def run_case(case, repeat, geometry_file = None):
+    ''' Runs one case, and returns a dictionary of its results. '''
+    name, _, params, w, h = case
+    compute = total = None
+    for i in range(repeat):
+        counter = CountingSurface(w, h)
+        model = make_model(name, params, counter, geometry_file)
+        start = perf_counter()
+        model.go()
+        t = perf_counter() - start
+        compute = t if compute is None else min(compute, t)
+
+        timer = FrameTimer(w, h)
+        surface = Surface(w, h, QColor("white"), present = timer.present)
+        timed_present(surface, timer)
+        model = make_model(name, params, surface, geometry_file)
+        start = perf_counter()
+        model.go()
+        surface.present() # the last frame, as RenderWorker does
+        t = perf_counter() - start
+        if total is None or t < total:
+            total, frames, frame_seconds = t, timer.frames, timer.seconds
+    primitives = counter.lines + counter.circles
+    return {"lines": counter.lines, "circles": counter.circles,
+        "compute_s": compute, "paint_s": max(total - compute, 0), "total_s": total,
+        "frames": frames, "frame_ms": 1000 * frame_seconds / max(frames, 1),
+        "nodes_per_s": counter.circles / total, "segments_per_s": counter.lines / total,
+        "primitives_per_s": primitives / total}
+
+def case_id(case):
+    return "%s/%s" % (case[0], case[1])
+
+def run_all(cases, repeat):
+    ''' Runs the cases, printing each result as it finishes. '''
+    app = QGuiApplication.instance() or QGuiApplication([])
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for case in cases:
+            geometry_file = None
+            if case[0] == "Geometry":
+                geometry_file = os.path.join(folder, "bench.geo")
+                model = make_model("Branch", case[2], Surface(case[3], case[4]), None)
+                GeometryExport(model, case[3], case[4], geometry_file, 1, QColor("white")).run()
+            result = run_case(case, repeat, geometry_file)
+            results[case_id(case)] = result
+            print("%-36s %9.0f nodes/s %9.0f segments/s  compute %7.1f ms  paint %7.1f ms  %6.2f ms/frame"
+                % (case_id(case), result["nodes_per_s"], result["segments_per_s"],
+                1000 * result["compute_s"], 1000 * result["paint_s"], result["frame_ms"]))
+    return {"python": platform.python_version(), "pyside": pyside_version,
+        "machine": platform.machine(), "system": platform.system(), "results": results}
+
+def compare(results, baseline, threshold):
+    ''' Prints how each time changed from the baseline, and returns the
+    number of times which got slower by more than threshold. '''
+    regressions = 0
+    for name, result in results["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            print("%-36s not in baseline" % name)
+            continue
+        for time in TIMES:
+            if not old.get(time):
+                continue
+            change = result[time] / old[time] - 1
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print("%-36s %-10s %10.2f -> %10.2f  %+6.1f%%%s" % (name, time,
+                old[time] * (1 if time == "frame_ms" else 1000),
+                result[time] * (1 if time == "frame_ms" else 1000), 100 * change, flag))
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = "Benchmark the models without a window.")
+    parser.add_argument("-o", "--output", default = "bench.json", help = "JSON file to save the results to")
+    parser.add_argument("--compare", help = "JSON file of baseline results to compare with")
+    parser.add_argument("--threshold", type = float, default = .1, help = "slowdown counted as a regression (default: %(default)s)")
+    parser.add_argument("--repeat", type = int, default = 5, help = "runs of each case; the fastest is kept")
+    parser.add_argument("-k", dest = "only", help = "only run cases whose name contains this")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        # the results would overwrite the baseline before it is read
+        if os.path.realpath(args.compare) == os.path.realpath(args.output):
+            parser.error("--compare and --output are the same file; save the results elsewhere with -o")
+        # read it before the benchmarks run, so a bad file fails at once
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    cases = [case for case in CASES if args.only is None or args.only in case_id(case)]
+    results = run_all(cases, args.repeat)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent = 2)
+    print("Results saved as %s" % args.output)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("%i regression(s) against %s" % (regressions, args.compare))
+            return 1
+        print("No regressions against %s" % args.compare)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
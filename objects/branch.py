@@ -1,19 +1,37 @@
-from PySide2.QtGui import QColor, QPainter
-from PySide2.QtCore import QPoint, Qt
+from PySide2.QtCore import Qt
 from PySide2.QtWidgets import *
 from time import sleep
-from matplotlib import cm
 import numpy as np
-from random import randint, random
+from random import Random, randint
 from math import log, floor
 try:
-    from objects.generator import Generator
+    from objects.generator import Generator, get_cmap, CMAP_NAMES
 except:
-    from generator import Generator
+    from generator import Generator, get_cmap, CMAP_NAMES
+
+MASK = (1 << 64) - 1
+
+def split(seed, n):
+    ''' Returns the n-th number of the SplitMix64 sequence started from a 64
+    bit seed. This gives each node of a tree as many independent random
+    numbers as it needs from its seed, much faster than making a Random for
+    every node. '''
+    z = (seed + n * 0x9E3779B97F4A7C15) & MASK
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK
+    return z ^ (z >> 31)
 
 class Branch(Generator):
     ''' A model which creates tree-like structures by generating copies of
     itself with modified size, position and color in relation to the parent. '''
+    # model parameters and their default values. A seed of None picks a new
+    # random tree every time; any other value always grows the same tree.
+    defaults = {"cmap_name": "viridis", "num_children": 3, "max_depth": 9,
+        "branch_prob": 0.6, "centerness": 0.3, "draw_lines": True, "size": 15,
+        "size_grow": .9, "length": 50, "length_grow": .9, "curve": 10,
+        "fan": 90, "seed": None}
+    version = 2 # each node has its own random generator
+
     def __init__(self, canvas, parent = None, child_no = 0):
         ''' Create a branch - by default, it will be a head node, but upon
         calling "go", more instances will be created with the creator as the
@@ -39,11 +57,13 @@ class Branch(Generator):
             self.branch_prob = self.parent.branch_prob
             self.centerness = self.parent.centerness
             self.distribution = self.parent.distribution
+            self.depth_limit = self.parent.depth_limit
         else: # only these need to be set for the parent, and aren't in reset()
             self.x = canvas.w // 2
             self.y = canvas.h // 2
             self.angle = -90
             self.depth = 0
+            self.depth_limit = None # nodes this deep are not drawn (see set_quality)
 
     def step(self):
         ''' calculates parameters of current state/node instance. Each of these
@@ -55,33 +75,41 @@ class Branch(Generator):
 
     def go(self):
         ''' Runs the generation and drawing of the tree. '''
+        self.seed_node()
         self.step() # calculate current parameters
         self.children = []
         if self.depth >= self.max_depth: # do not exceed max branch depth
             return
-        for i in range(self.num_children): # create children
-            if self.node_choice(i): # always true for 1, never for 0
-                child = Branch(self.canvas, parent = self, child_no = i)
-                self.children.append(child)
-                child.go() # run child: calculate parameters, generate children, and draw
+        # nodes at max_depth (or a preview's depth_limit) are not drawn, so
+        # they are not generated either
+        limit = self.max_depth if self.depth_limit is None else min(self.max_depth, self.depth_limit)
+        if self.depth + 1 < limit:
+            for i in range(self.num_children): # create children
+                if self.node_choice(i): # always true for 1, never for 0
+                    child = Branch(self.canvas, parent = self, child_no = i)
+                    self.children.append(child)
+                    child.go() # run child: calculate parameters, generate children, and draw
         self.draw() # draw self last so that lines drawn by children are covered
 
-    def draw(self):
-        ''' Draws this node of the tree and updates the canvas. '''
-        p = QPainter(self.canvas.pixmap())
-        p.setPen(self.color)
-        p.setBrush(self.color)
+    def seed_node(self):
+        ''' Gives this node its own 64 bit seed, taken from its parent's
+        seed and its child number (or, for the head, from the tree's seed).
+        The node's random choices come from its seed alone, so they do not
+        depend on any other subtree, and a preview which leaves out the deep
+        nodes still grows exactly the top of the full tree. '''
+        if self.parent is None:
+            self.node_seed = Random(self.seed).getrandbits(64)
+        else:
+            self.node_seed = split(self.parent.node_seed, 2 * self.child_no + 2)
 
+    def draw(self):
+        ''' Draws this node of the tree on the canvas. '''
         # draw a stem if appropriate
         if self.parent is not None and self.draw_lines:
             prevx = self.parent.x + self.parent.size * np.cos(self.angle * np.pi / 180)
             prevy = self.parent.y + self.parent.size * np.sin(self.angle * np.pi / 180)
-            p.drawLine(prevx, prevy, self.x, self.y)
-        c = QPoint(self.x, self.y)
-        p.drawEllipse(c, self.size, self.size)
-        p.end()
-        # Repaint for every node, so gradual generation can be seen
-        self.canvas.repaint()
+            self.canvas.line(prevx, prevy, self.x, self.y, self.color, depth = self.depth, index = self.color_index)
+        self.canvas.circle(self.x, self.y, self.size, self.color, depth = self.depth, index = self.color_index)
 
     def calc_len(self):
         ''' calculate and set branch length based on parent's branch length '''
@@ -104,8 +132,7 @@ class Branch(Generator):
 
     def calc_color(self):
         ''' Calculate and set color based on tree depth of this node '''
-        r, g, b, a = self.cmap(self.depth/(self.max_depth - 1))
-        self.color = QColor(r * 255, g * 255, b * 255)
+        self.color_index, self.color = self.cmap.lookup(self.depth/(self.max_depth - 1))
 
     def calc_size(self):
         ''' Calculate and set size based on parent's size '''
@@ -128,8 +155,36 @@ class Branch(Generator):
                 suggested_depth = min([self.max_depth, suggested_depth])
             return suggested_depth
 
+    def level_sizes(self):
+        ''' Returns the expected number of nodes drawn at each depth. Nodes at
+        max_depth are never drawn. '''
+        branches = sum(min(self.branch_prob * d, 1) for d in self.distribution)
+        sizes = [1]
+        for depth in range(1, self.max_depth):
+            sizes.append(sizes[-1] * branches)
+        return sizes
+
+    def estimate_primitives(self, depth_limit = None):
+        ''' Expected number of circles and lines drawn, down to depth_limit
+        (or the whole tree). '''
+        nodes = sum(self.level_sizes()[:depth_limit])
+        return int(nodes * 2 - 1 if self.draw_lines else nodes)
+
+    def set_quality(self, max_primitives):
+        ''' Limits the depth drawn, so that a preview shows the top of the
+        same tree the full render would grow. '''
+        self.depth_limit = None
+        for limit in range(self.max_depth, 1, -1):
+            if self.estimate_primitives(limit) <= max_primitives:
+                break
+        else:
+            limit = 1
+        if limit < self.max_depth:
+            self.depth_limit = limit
+        return self.estimate_primitives(limit)
+
     def node_choice(self, child_no):
-        vote = random()
+        vote = split(self.node_seed, 2 * child_no + 1) / 2 ** 64
         decision = self.branch_prob * self.distribution[child_no]
         if vote < decision:
             return True
@@ -152,34 +207,49 @@ class Branch(Generator):
         self.distribution = distribution
 
     def randomize(self):
-        ''' Randomize customizable settings of the tree model '''
-        if randint(0, 1) > 0:
-            self.draw_lines = True
-            c = Qt.Checked
-        else:
-            self.draw_lines = False
-            c = Qt.Unchecked
-        self.num_children = randint(2, 6)
+        ''' Randomize customizable settings of the tree model. A new seed is
+        picked and recorded, and both the settings and the tree grown from
+        them come from it, so the same seed always gives the same design. '''
+        self.randomize_params(randint(0, 99999999))
+        self.sync_menu()
+
+    def randomize_params(self, seed):
+        ''' Randomize the model parameters from the given seed, without
+        touching the settings controls. '''
+        self.seed = seed
+        rng = Random(seed)
+        self.draw_lines = rng.randint(0, 1) > 0
+        self.num_children = rng.randint(2, 6)
         suggested_depth = self.suggested_max_depth(self.num_children, upper_limit=True)
-        self.max_depth = randint(4, suggested_depth)
-        self.branch_prob = randint(5, 10) / 10
-        self.centerness = randint(0, 5) / 10
-        self.curve = randint(-60, 60)
+        self.max_depth = rng.randint(4, suggested_depth)
+        self.branch_prob = rng.randint(5, 10) / 10
+        self.centerness = rng.randint(0, 5) / 10
+        self.curve = rng.randint(-60, 60)
         suggested_fan = 360 - (360 // self.num_children)
-        self.fan = randint(0, suggested_fan)
-        self.size = randint(15, 80)
-        size_grow_percent = randint(50, 120)
+        self.fan = rng.randint(0, suggested_fan)
+        self.size = rng.randint(15, 80)
+        size_grow_percent = rng.randint(50, 120)
         self.size_grow = size_grow_percent / 100
         # make length more than size of nodes
-        self.length = randint(self.size//2, 200)
+        self.length = rng.randint(self.size//2, 200)
         # have length grow faster than size
-        self.length_grow = randint(size_grow_percent, 150) / 100
+        self.length_grow = rng.randint(size_grow_percent, 150) / 100
         # update branch probability distribution with new parameters
         self.calc_distribution()
 
-        # set all setting controls to reflect this
+    def sync_menu(self):
+        ''' Set all setting controls to reflect the model parameters. Their
+        signals are blocked meanwhile, so the controls do not adjust the
+        parameters (like set_children adjusting the depth) as they change. '''
+        boxes = [self.cmap_box, self.max_depth_box, self.draw_lines_box,
+            self.children_box, self.branch_prob_box, self.centerness_box,
+            self.curve_box, self.fan_box, self.size_box, self.size_grow_box,
+            self.len_box, self.len_grow_box, self.seed_box]
+        for box in boxes:
+            box.blockSignals(True)
+        self.cmap_box.setCurrentText(self.cmap_name)
         self.max_depth_box.setValue(self.max_depth)
-        self.draw_lines_box.setCheckState(c)
+        self.draw_lines_box.setCheckState(Qt.Checked if self.draw_lines else Qt.Unchecked)
         self.children_box.setValue(self.num_children)
         self.branch_prob_box.setValue(self.branch_prob)
         self.centerness_box.setValue(self.centerness)
@@ -189,6 +259,9 @@ class Branch(Generator):
         self.size_grow_box.setValue(self.size_grow)
         self.len_box.setValue(self.length)
         self.len_grow_box.setValue(self.length_grow)
+        self.seed_box.setValue(-1 if self.seed is None else self.seed)
+        for box in boxes:
+            box.blockSignals(False)
 
     def init_menu_layout(self):
         ''' create a menu layout for the settings of this model, reset/
@@ -197,13 +270,7 @@ class Branch(Generator):
         l = QGridLayout()
         self.cmap_label = QLabel("Color map:")
         self.cmap_box = QComboBox()
-        self.cmap_box.addItems(['viridis', 'plasma', 'inferno', 'magma', 'gray', 'bone', 'pink',
-            'spring', 'summer', 'autumn', 'winter', 'cool', 'Wistia',
-            'hot', 'afmhot', 'gist_heat', 'copper', 'PiYG', 'PRGn', 'BrBG', 'PuOr', 'RdGy', 'RdBu',
-            'RdYlBu', 'RdYlGn', 'Spectral', 'coolwarm', 'bwr', 'seismic', 'twilight', 'twilight_shifted', 'hsv',
-             'ocean', 'gist_earth', 'terrain', 'gist_stern',
-            'gnuplot', 'gnuplot2', 'CMRmap', 'cubehelix', 'brg',
-            'gist_rainbow', 'rainbow', 'jet', 'nipy_spectral', 'gist_ncar'])
+        self.cmap_box.addItems(CMAP_NAMES)
         self.cmap_box.activated[str].connect(self.set_cmap)
         self.children_label = QLabel("Children:")
         self.children_box = QSpinBox()
@@ -227,6 +294,8 @@ class Branch(Generator):
         self.curve_box = QSpinBox()
         self.fan_label = QLabel("Fan:")
         self.fan_box = QSpinBox()
+        self.seed_label = QLabel("Seed:")
+        self.seed_box = QSpinBox()
         l.addWidget(self.cmap_label, 0, 0)
         l.addWidget(self.cmap_box, 0, 1)
         l.addWidget(self.children_label, 1, 0)
@@ -251,6 +320,8 @@ class Branch(Generator):
         l.addWidget(self.curve_box, 10, 1)
         l.addWidget(self.fan_label, 11, 0)
         l.addWidget(self.fan_box, 11, 1)
+        l.addWidget(self.seed_label, 12, 0)
+        l.addWidget(self.seed_box, 12, 1)
         self.reset()
         return l
 
@@ -258,78 +329,80 @@ class Branch(Generator):
         ''' reset all model parameters and their corresponding settings to
         default values. '''
         self.cmap_box.setCurrentIndex(0)
-        self.cmap = cm.get_cmap("viridis")
 
         self.children_box.setMinimum(1)
         self.children_box.setMaximum(12)
         self.children_box.setValue(3)
         self.children_box.valueChanged.connect(self.set_children)
-        self.num_children = 3
 
         self.max_depth_box.setMinimum(1)
         self.max_depth_box.setMaximum(15)
         self.max_depth_box.setValue(9)
         self.max_depth_box.valueChanged.connect(self.set_max_depth)
-        self.max_depth = 9
 
         self.branch_prob_box.setMinimum(.1)
         self.branch_prob_box.setMaximum(1.0)
         self.branch_prob_box.setValue(.6)
         self.branch_prob_box.valueChanged.connect(self.set_branch_prob)
-        self.branch_prob = 0.6
 
         self.centerness_box.setMinimum(0.0)
         self.centerness_box.setMaximum(1.0)
         self.centerness_box.setValue(0.3)
         self.centerness_box.valueChanged.connect(self.set_centerness)
-        self.centerness = 0.3
-        # calculate branching probability distribution with current number of
-        # children and centerness (center-favoring probability)
-        self.calc_distribution()
 
         self.draw_lines_box.setCheckState(Qt.Checked)
         self.draw_lines_box.toggled.connect(self.set_draw_lines)
-        self.draw_lines = True
 
         self.size_box.setMinimum(1)
         self.size_box.setMaximum(400)
         self.size_box.setValue(15)
         self.size_box.valueChanged.connect(self.set_size)
-        self.size = 15
 
         self.size_grow_box.setMinimum(.1)
         self.size_grow_box.setMaximum(2.0)
         self.size_grow_box.setValue(.9)
         self.size_grow_box.valueChanged.connect(self.set_grow_size)
-        self.size_grow = .9
 
         self.len_box.setMinimum(10)
         self.len_box.setMaximum(200)
         self.len_box.setValue(50)
         self.len_box.valueChanged.connect(self.set_len)
-        self.length = 50
 
         self.len_grow_box.setMinimum(.1)
         self.len_grow_box.setMaximum(2.0)
         self.len_grow_box.setValue(.9)
         self.len_grow_box.valueChanged.connect(self.set_grow_len)
-        self.length_grow = .9
 
         self.curve_box.setMinimum(-180)
         self.curve_box.setMaximum(180)
         self.curve_box.setValue(10)
         self.curve_box.valueChanged.connect(self.set_curve)
-        self.curve = 10
 
         self.fan_box.setMinimum(0)
         self.fan_box.setMaximum(360)
         self.fan_box.setValue(90)
         self.fan_box.valueChanged.connect(self.set_fan)
-        self.fan = 90
+
+        # -1 means no seed: a new random tree every time
+        self.seed_box.setMinimum(-1)
+        self.seed_box.setMaximum(99999999)
+        self.seed_box.setSpecialValueText("Random")
+        self.seed_box.setValue(-1)
+        self.seed_box.valueChanged.connect(self.set_seed)
+
+        self.set_params(self.defaults)
+
+    def update_params(self):
+        ''' Recompute the values derived from the model parameters. '''
+        self.cmap = get_cmap(self.cmap_name)
+        # calculate branching probability distribution with current number of
+        # children and centerness (center-favoring probability)
+        self.calc_distribution()
 
     ''' functions for setting model parameters on interface events. '''
     def set_cmap(self, name):
-        self.cmap = cm.get_cmap(name)
+        self.cmap_name = name
+        self.cmap = get_cmap(name)
 
     def set_children(self, n):
         self.num_children = n
@@ -377,3 +450,6 @@ class Branch(Generator):
 
     def set_fan(self, n):
         self.fan = n
+
+    def set_seed(self, n):
+        self.seed = None if n < 0 else n
@@ -0,0 +1,119 @@
+from PySide2.QtGui import QImage
+from hashlib import sha256
+import os
+from itertools import count
+try:
+    from objects.profiler import profiler
+except:
+    from profiler import profiler
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pretty-useless-plots")
+temp_ids = count() # numbers temporary files, see RenderCache.temp_name
+
+class RenderCache:
+    ''' A content-addressed cache of finished renders on disk.
+
+    Renders are stored under the hash of their key (see Generator.cache_key),
+    which describes everything that decides what gets drawn, so the same
+    parameters on the same canvas always find the same file. The primitives
+    a model drew are stored as a geometry file the same way, under its
+    geometry key (see Generator.geometry_key), so the drawing can be painted
+    again on any background or at any scale without generating it. Next to
+    each entry, the key itself is saved as JSON so the cache can be inspected.
+
+    The cache is kept under max_bytes by evicting the least recently used
+    entries; a file's modification time is bumped whenever it is read. Files
+    are written under a temporary name and then renamed, so several processes
+    can share one cache. '''
+    def __init__(self, directory = DEFAULT_DIR, max_bytes = 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok = True)
+
+    def path(self, key, ext = ".png"):
+        ''' Returns the file name for a key. '''
+        return os.path.join(self.directory, sha256(key.encode()).hexdigest() + ext)
+
+    def get_file(self, key, ext = ".png"):
+        ''' Returns the file cached for a key, or None on a miss. '''
+        if key is None:
+            return None
+        file_name = self.path(key, ext)
+        kind = "geometry cache" if ext == ".geo" else "cache"
+        try:
+            os.utime(file_name) # mark as recently used
+        except FileNotFoundError:
+            if profiler.enabled:
+                profiler.count(kind + " misses")
+            return None
+        if profiler.enabled:
+            profiler.count(kind + " hits")
+        return file_name
+
+    def get_geometry(self, key):
+        ''' Returns the geometry file cached for a key, or None on a miss. '''
+        return self.get_file(key, ".geo")
+
+    def temp_name(self, key, ext):
+        ''' Returns a file name to write an entry under before it is put in
+        the cache, which no other process or thread is using. '''
+        return "%s.%i.%i.tmp" % (self.path(key, ext), os.getpid(), next(temp_ids))
+
+    def get(self, key):
+        ''' Returns the QImage cached for a key, or None on a miss. '''
+        file_name = self.get_file(key)
+        if file_name is None:
+            return None
+        image = QImage(file_name)
+        return None if image.isNull() else image
+
+    def put(self, key, image):
+        ''' Stores a finished render for a key, then evicts old entries if
+        the cache has grown too big. '''
+        if key is None:
+            return
+        tmp = self.temp_name(key, ".png")
+        if not image.save(tmp, "PNG"):
+            return
+        os.replace(tmp, self.path(key))
+        self.save_key(key)
+        self.evict()
+
+    def put_geometry(self, key, file_name):
+        ''' Moves a finished geometry file (written under temp_name) into the
+        cache for a key, then evicts old entries if the cache has grown too
+        big. '''
+        if key is None:
+            return
+        os.replace(file_name, self.path(key, ".geo"))
+        self.save_key(key)
+        self.evict()
+
+    def save_key(self, key):
+        ''' Saves the key as JSON next to its entry. '''
+        tmp = self.temp_name(key, ".json")
+        with open(tmp, "w") as f:
+            f.write(key)
+        os.replace(tmp, self.path(key, ".json"))
+
+    def evict(self):
+        ''' Removes the least recently used entries until the cache is under
+        its size limit. '''
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith((".png", ".geo")):
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError: # evicted by another process
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for ext in (name[-4:], ".json"):
+                try:
+                    os.remove(os.path.join(self.directory, name[:-4] + ext))
+                except FileNotFoundError:
+                    pass
+            total -= size
@@ -0,0 +1,402 @@
+from PySide2.QtGui import QImage, QColor
+from PySide2.QtCore import QRect
+from copy import copy
+from random import randrange
+from math import hypot
+import numpy as np
+import tempfile
+import struct
+import zlib
+import os
+try:
+    from objects.surface import Surface, RenderCancelled
+    from objects.geometry import GeometrySurface, open_geometry, bounds, draw_primitives, geometry_info
+except:
+    from surface import Surface, RenderCancelled
+    from geometry import GeometrySurface, open_geometry, bounds, draw_primitives, geometry_info
+
+def snapshot(model):
+    ''' Returns a copy of the model, restarted, for an export to draw. The
+    settings can then keep changing without affecting the export. A model with
+    a seed parameter is given a fixed seed, so that every pass over it draws
+    the same drawing. '''
+    model = copy(model)
+    model.depth = 0
+    if "seed" in model.defaults and model.seed is None:
+        model.seed = randrange(2 ** 32)
+    return model
+
+def make_export(model, w, h, file_name, scale, bg_color):
+    ''' Returns the right kind of export for the file name: vector for SVG
+    files, geometry for .geo files, tiled raster otherwise. '''
+    if file_name.lower().endswith(".svg"):
+        return SVGExport(model, w, h, file_name, scale, bg_color)
+    if file_name.lower().endswith(".geo"):
+        return GeometryExport(model, w, h, file_name, scale, bg_color)
+    return TiledExport(model, w, h, file_name, scale, bg_color)
+
+def image_to_array(image):
+    ''' Returns the pixels of a QImage as a (height, width, 3) RGB array. '''
+    image = image.convertToFormat(QImage.Format_RGB888)
+    w, h = image.width(), image.height()
+    rows = np.frombuffer(image.constBits(), np.uint8, count = image.bytesPerLine() * h)
+    # copy, since the array would otherwise point into the converted image
+    return rows.reshape(h, image.bytesPerLine())[:, :w * 3].reshape(h, w, 3).copy()
+
+class PNGWriter:
+    ''' Writes an RGB PNG file a band of rows at a time, compressing as it
+    goes, so the whole image never has to be in memory. '''
+    def __init__(self, file_name, w, h):
+        self.w, self.h = w, h
+        self.f = open(file_name, "wb")
+        self.f.write(b"\x89PNG\r\n\x1a\n")
+        self.chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0))
+        self.z = zlib.compressobj(6)
+
+    def chunk(self, kind, data):
+        self.f.write(struct.pack(">I", len(data)) + kind + data)
+        self.f.write(struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    def write_rows(self, rows):
+        ''' Appends an (n, width, 3) array of rows to the image. '''
+        n = len(rows)
+        lines = np.zeros((n, 1 + self.w * 3), np.uint8) # filter byte 0 (none)
+        lines[:, 1:] = rows.reshape(n, -1)
+        data = self.z.compress(lines.tobytes())
+        if data:
+            self.chunk(b"IDAT", data)
+
+    def close(self):
+        self.chunk(b"IDAT", self.z.flush())
+        self.chunk(b"IEND", b"")
+        self.f.close()
+
+class TIFFWriter:
+    ''' Writes a tiled, deflate-compressed RGB TIFF file one tile at a time,
+    so only one tile has to be in memory. Tiles are written in row order. The
+    tile size must be a multiple of 16, and the file must stay under 4 GB. '''
+    def __init__(self, file_name, w, h, tile_size):
+        self.w, self.h = w, h
+        self.tile_size = tile_size
+        self.f = open(file_name, "wb")
+        self.f.write(b"II*\x00\x00\x00\x00\x00") # IFD offset filled in on close
+        self.offsets = []
+        self.counts = []
+
+    def write_tile(self, tile):
+        ''' Appends one (height, width, 3) tile, padding edge tiles to size. '''
+        t = self.tile_size
+        padded = np.zeros((t, t, 3), np.uint8)
+        padded[:tile.shape[0], :tile.shape[1]] = tile
+        data = zlib.compress(padded.tobytes(), 6)
+        self.offsets.append(self.f.tell())
+        self.counts.append(len(data))
+        self.f.write(data)
+
+    def write_array(self, kind, values):
+        ''' Writes an array of SHORT ("H") or LONG ("I") values and returns
+        its offset. '''
+        offset = self.f.tell()
+        self.f.write(struct.pack("<%i%s" % (len(values), kind), *values))
+        return offset
+
+    def close(self):
+        n = len(self.offsets)
+        bits = self.write_array("H", [8, 8, 8])
+        offsets = self.write_array("I", self.offsets) if n > 1 else self.offsets[0]
+        counts = self.write_array("I", self.counts) if n > 1 else self.counts[0]
+        if self.f.tell() % 2: # the IFD must start on a word boundary
+            self.f.write(b"\x00")
+        # (tag, type, count, value) with type 3 = SHORT and 4 = LONG
+        tags = [(256, 4, 1, self.w), (257, 4, 1, self.h), (258, 3, 3, bits),
+            (259, 3, 1, 8), (262, 3, 1, 2), (277, 3, 1, 3), (284, 3, 1, 1),
+            (322, 4, 1, self.tile_size), (323, 4, 1, self.tile_size),
+            (324, 4, n, offsets), (325, 4, n, counts)]
+        ifd = self.f.tell()
+        self.f.write(struct.pack("<H", len(tags)))
+        for tag, kind, count, value in tags:
+            if kind == 3 and count == 1:
+                self.f.write(struct.pack("<HHIHH", tag, kind, count, value, 0))
+            else:
+                self.f.write(struct.pack("<HHII", tag, kind, count, value))
+        self.f.write(struct.pack("<I", 0)) # no more IFDs
+        self.f.seek(4)
+        self.f.write(struct.pack("<I", ifd))
+        self.f.close()
+
+class TiledExport:
+    ''' Re-renders a model at any scale factor, one tile at a time, streaming
+    the tiles into a PNG or TIFF file (chosen by the file extension).
+
+    The model is generated only once, into a temporary geometry file (see
+    objects/geometry.py). Each band of tiles then picks out the primitives
+    whose bounding boxes reach into it, and each tile draws just those of
+    them which reach into the tile, on a surface which only holds that tile.
+    Memory is therefore bounded by the tile size rather than the image size
+    (a PNG is written in bands, so it also holds one row of tiles), and the
+    generation is not repeated for every tile. '''
+    def __init__(self, model, w, h, file_name, scale, bg_color, tile_size = 1024, chunk_size = 65536):
+        self.model = snapshot(model)
+        self.w, self.h = w, h
+        self.file_name = file_name
+        self.scale = scale
+        self.bg_color = bg_color
+        self.tile_size = tile_size
+        self.chunk_size = chunk_size
+        self.recording = None # the GeometryExport generating the model
+        self.surface = None
+        self.cancelled = False
+
+    def record(self, geometry_file):
+        ''' Generates the model once, into a geometry file. '''
+        self.recording = GeometryExport(self.model, self.w, self.h, geometry_file, self.scale, self.bg_color)
+        if self.cancelled:
+            self.recording.cancel()
+        self.recording.run()
+
+    def select(self, columns, rows, left, top, right, bottom):
+        ''' Returns the row numbers among rows (a slice or an array of them)
+        of the primitives which reach into a rectangle of the scaled image. '''
+        # rectangle in canvas coordinates, with a margin for antialiasing
+        s, margin = self.scale, 2 / self.scale
+        x0, y0, x1, y1 = bounds(columns, rows)
+        keep = ((x1 >= left / s - margin) & (x0 <= right / s + margin)
+            & (y1 >= top / s - margin) & (y0 <= bottom / s + margin))
+        if isinstance(rows, slice):
+            return rows.start + np.flatnonzero(keep)
+        return rows[keep]
+
+    def select_all(self, columns, count, left, top, right, bottom):
+        ''' Like select, for all of the count primitives of a geometry file,
+        reading it a chunk at a time. The row numbers are in drawing order. '''
+        parts = [np.empty(0, np.intp)]
+        for start in range(0, count, self.chunk_size):
+            rows = slice(start, min(start + self.chunk_size, count))
+            parts.append(self.select(columns, rows, left, top, right, bottom))
+        return np.concatenate(parts)
+
+    def render_tile(self, tile, columns, rows, colors):
+        ''' Draws the primitives in rows which reach into one tile of the
+        image on a surface holding that tile, and returns its pixels. '''
+        self.surface = Surface(self.w, self.h, self.bg_color, scale = self.scale, tile = tile)
+        if self.cancelled:
+            raise RenderCancelled()
+        rows = self.select(columns, rows, tile.left(), tile.top(), tile.right() + 1, tile.bottom() + 1)
+        for start in range(0, len(rows), self.chunk_size):
+            draw_primitives(self.surface, columns, rows[start:start + self.chunk_size], colors)
+        self.surface.end()
+        return image_to_array(self.surface.image)
+
+    def run(self, progress = None):
+        ''' Renders and saves every tile, calling progress(done, total) after
+        each. Raises RenderCancelled if cancel() is called meanwhile. '''
+        W, H = int(self.w * self.scale), int(self.h * self.scale)
+        t = self.tile_size
+        cols, rows = -(-W // t), -(-H // t)
+        if progress is not None:
+            progress(0, rows * cols)
+        with tempfile.TemporaryDirectory() as folder:
+            geometry_file = os.path.join(folder, "export.geo")
+            self.record(geometry_file)
+            header, columns = open_geometry(geometry_file)
+            colors = self.model.cmap.colors
+            tiff = self.file_name.lower().endswith((".tif", ".tiff"))
+            if tiff:
+                writer = TIFFWriter(self.file_name, W, H, t)
+            else:
+                writer = PNGWriter(self.file_name, W, H)
+            try:
+                for row in range(rows):
+                    th = min(t, H - row * t)
+                    band_rows = self.select_all(columns, header["count"], 0, row * t, W, row * t + th)
+                    band = None if tiff else np.empty((th, W, 3), np.uint8)
+                    for col in range(cols):
+                        tw = min(t, W - col * t)
+                        pixels = self.render_tile(QRect(col * t, row * t, tw, th), columns, band_rows, colors)
+                        if tiff:
+                            writer.write_tile(pixels)
+                        else:
+                            band[:, col * t:col * t + tw] = pixels
+                        if progress is not None:
+                            progress(row * cols + col + 1, rows * cols)
+                    if not tiff:
+                        writer.write_rows(band)
+            finally:
+                writer.close()
+                columns = None # unmap the file before it is removed
+
+    def cancel(self):
+        ''' Stops the export at the next primitive drawn. '''
+        self.cancelled = True
+        if self.recording is not None:
+            self.recording.cancel()
+        if self.surface is not None:
+            self.surface.cancelled = True
+
+def fmt(v):
+    ''' Formats a coordinate for SVG, with no more digits than needed. '''
+    return ("%.2f" % v).rstrip("0").rstrip(".")
+
+def segment_distance(q, a, b):
+    ''' Returns the distance from point q to the line segment from a to b. '''
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    length2 = dx * dx + dy * dy
+    t = 0 if length2 == 0 else ((q[0] - a[0]) * dx + (q[1] - a[1]) * dy) / length2
+    t = min(max(t, 0), 1)
+    return hypot(q[0] - a[0] - t * dx, q[1] - a[1] - t * dy)
+
+class SVGSurface:
+    ''' A drawing target with the same primitive methods as Surface, which
+    streams the drawing into an SVG file instead of painting pixels.
+
+    Connected line segments of the same color and width are merged into one
+    polyline, and points which lie within "tolerance" pixels (of the output,
+    at the given scale) of the line between their neighbours are dropped. Only the polyline being built is held in
+    memory (at most max_points points), so the size of the drawing does not
+    matter. '''
+    def __init__(self, file_name, w, h, bg_color, scale = 1, tolerance = .25, max_points = 1000):
+        self.w, self.h = w, h
+        self.tolerance = tolerance / scale # in canvas units
+        self.max_points = max_points
+        self.cancelled = False
+        self.path = [] # points of the polyline being built
+        self.skipped = [] # points dropped from the path since its last point
+        self.style = None # color name and width of the polyline
+        self.f = open(file_name, "w")
+        self.f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.f.write('<svg xmlns="http://www.w3.org/2000/svg" width="%s" height="%s" viewBox="0 0 %s %s">\n'
+            % (fmt(w * scale), fmt(h * scale), fmt(w), fmt(h)))
+        self.f.write('<rect width="100%%" height="100%%" fill="%s"/>\n' % QColor(bg_color).name())
+        # Qt's default pen has square caps and bevel joins
+        self.f.write('<g fill="none" stroke-linecap="square" stroke-linejoin="bevel">\n')
+
+    def line(self, x1, y1, x2, y2, color, width = 1, depth = 0, index = 0):
+        ''' Adds a line segment, extending the current polyline if it starts
+        where that one ends and has the same color and width. '''
+        style = (color.name(), width)
+        if not self.path or style != self.style or self.path[-1] != (x1, y1):
+            self.flush()
+            self.style = style
+            self.path = [(x1, y1)]
+        self.add_point((x2, y2))
+        self.drawn()
+
+    def add_point(self, p):
+        ''' Adds a point to the polyline. If the last point (and any dropped
+        before it) would be within tolerance of the line from the point before
+        it to the new one, it is replaced instead of kept. '''
+        if len(self.path) >= 2 and len(self.skipped) < 64:
+            anchor = self.path[-2]
+            candidates = self.skipped + [self.path[-1]]
+            if all(segment_distance(q, anchor, p) <= self.tolerance for q in candidates):
+                self.skipped = candidates
+                self.path[-1] = p
+                return
+        self.skipped = []
+        self.path.append(p)
+        if len(self.path) >= self.max_points:
+            # write this much out, and carry on from its last point
+            self.flush()
+            self.path = [p]
+
+    def circle(self, x, y, r, color, depth = 0, index = 0):
+        ''' Writes a filled circle, outlined like Surface's. '''
+        self.flush()
+        c = color.name()
+        self.f.write('<circle cx="%s" cy="%s" r="%s" fill="%s" stroke="%s"/>\n'
+            % (fmt(x), fmt(y), fmt(r), c, c))
+        self.drawn()
+
+    def drawn(self):
+        if self.cancelled:
+            raise RenderCancelled()
+
+    def flush(self):
+        ''' Writes out the polyline being built. '''
+        if len(self.path) >= 2:
+            color, width = self.style
+            points = " ".join("%s,%s" % (fmt(x), fmt(y)) for x, y in self.path)
+            self.f.write('<polyline points="%s" stroke="%s" stroke-width="%s"/>\n'
+                % (points, color, fmt(width)))
+        self.path = []
+        self.skipped = []
+
+    def close(self):
+        self.flush()
+        self.f.write("</g>\n</svg>\n")
+        self.f.close()
+
+class SVGExport:
+    ''' Exports a model as an SVG file, streaming its primitives from the
+    generation loop straight into the file. The scale factor only sets the
+    size the SVG is displayed at. '''
+    def __init__(self, model, w, h, file_name, scale, bg_color):
+        self.model = snapshot(model)
+        self.w, self.h = w, h
+        self.file_name = file_name
+        self.scale = scale
+        self.bg_color = bg_color
+        self.surface = None
+        self.cancelled = False
+
+    def run(self, progress = None):
+        ''' Draws the model into the file. There is no way to know how much is
+        left, so progress(0, 0) is called at the start and (1, 1) at the end.
+        Raises RenderCancelled if cancel() is called meanwhile. '''
+        if progress is not None:
+            progress(0, 0)
+        self.surface = SVGSurface(self.file_name, self.w, self.h, self.bg_color, self.scale)
+        self.surface.cancelled = self.cancelled
+        model = copy(self.model)
+        model.canvas = self.surface
+        try:
+            model.go()
+        finally:
+            self.surface.close()
+        if progress is not None:
+            progress(1, 1)
+
+    def cancel(self):
+        ''' Stops the export at the next primitive drawn. '''
+        self.cancelled = True
+        if self.surface is not None:
+            self.surface.cancelled = True
+
+class GeometryExport:
+    ''' Saves the primitives of a model to a geometry file (see
+    objects/geometry.py), along with the parameters it was drawn with, so the
+    drawing can be re-rendered later without generating it again. The scale
+    factor does not matter, since geometry is stored in canvas coordinates.
+    '''
+    def __init__(self, model, w, h, file_name, scale, bg_color):
+        self.model = snapshot(model)
+        self.w, self.h = w, h
+        self.file_name = file_name
+        self.bg_color = bg_color
+        self.surface = None
+        self.cancelled = False
+
+    def run(self, progress = None):
+        ''' Records the model into the file, calling progress(0, 0) at the
+        start and (1, 1) at the end. Raises RenderCancelled if cancel() is
+        called meanwhile, and leaves no file behind. '''
+        if progress is not None:
+            progress(0, 0)
+        model = copy(self.model)
+        self.surface = GeometrySurface(self.file_name, self.w, self.h, self.bg_color, geometry_info(model))
+        self.surface.cancelled = self.cancelled
+        model.canvas = self.surface
+        try:
+            model.go()
+        except:
+            self.surface.writer.discard()
+            raise
+        self.surface.close()
+        if progress is not None:
+            progress(1, 1)
+
+    def cancel(self):
+        ''' Stops the export at the next primitive drawn. '''
+        self.cancelled = True
+        if self.surface is not None:
+            self.surface.cancelled = True
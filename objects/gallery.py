@@ -0,0 +1,43 @@
+''' Rendering of thumbnails of randomized designs, in a pool of processes.
+
+Each thumbnail is one job: a model name, the parameters to start from, a
+seed, and the canvas it is drawn on. The process randomizes the model's
+parameters from the seed (see Branch.randomize_params), draws it at a small
+scale, and returns the exact parameters used along with the pixels, so the
+design can be loaded into the main model and drawn again in full. '''
+import os
+from importlib import import_module
+from PySide2.QtGui import QGuiApplication, QImage, QColor
+try:
+    from objects.surface import Surface
+except:
+    from surface import Surface
+
+def init_process():
+    ''' Runs at the start of each pool process: draws on an off-screen
+    platform, since the processes have no windows. '''
+    os.environ["QT_QPA_PLATFORM"] = "offscreen"
+    QGuiApplication.instance() or QGuiApplication([])
+
+def render_thumbnail(job):
+    ''' Renders one job, a dictionary with "model", "params", "seed",
+    "width", "height", "scale" and "background". Returns the job, the
+    parameters drawn with, and the image as (width, height, bytes per line,
+    pixels) so it can be passed back from the process. '''
+    name = job["model"]
+    surface = Surface(job["width"], job["height"], QColor(job["background"]), scale = job["scale"])
+    model = getattr(import_module("objects." + name.lower()), name)(surface)
+    model.set_params(model.defaults)
+    model.set_params(job["params"])
+    model.randomize_params(job["seed"])
+    model.go()
+    surface.end()
+    image = surface.image
+    pixels = bytes(image.constBits())[:image.bytesPerLine() * image.height()]
+    return job, model.get_params(), (image.width(), image.height(), image.bytesPerLine(), pixels)
+
+def to_image(data):
+    ''' Turns the image data returned by render_thumbnail back into a QImage.
+    '''
+    w, h, bytes_per_line, pixels = data
+    return QImage(pixels, w, h, bytes_per_line, QImage.Format_ARGB32_Premultiplied).copy()
@@ -1,14 +1,107 @@
-from matplotlib import cm
-from time import sleep
+from PySide2.QtGui import QColor
+from time import sleep, perf_counter
+import numpy as np
+import json
+import os
+try:
+    from objects.profiler import profiler
+except:
+    from profiler import profiler
+
+# names of the color maps offered in the settings panels
+CMAP_NAMES = ['viridis', 'plasma', 'inferno', 'magma', 'gray', 'bone', 'pink',
+    'spring', 'summer', 'autumn', 'winter', 'cool', 'Wistia',
+    'hot', 'afmhot', 'gist_heat', 'copper', 'PiYG', 'PRGn', 'BrBG', 'PuOr', 'RdGy', 'RdBu',
+    'RdYlBu', 'RdYlGn', 'Spectral', 'coolwarm', 'bwr', 'seismic', 'twilight', 'twilight_shifted', 'hsv',
+     'ocean', 'gist_earth', 'terrain', 'gist_stern',
+    'gnuplot', 'gnuplot2', 'CMRmap', 'cubehelix', 'brg',
+    'gist_rainbow', 'rainbow', 'jet', 'nipy_spectral', 'gist_ncar']
+
+# file of pre-baked color tables; if it exists, matplotlib is not needed
+BAKED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cmaps.npz")
+
+class Colormap:
+    ''' A color map turned into a lookup table of "size" uint8 RGBA entries,
+    plus a QColor for each entry. Looking up a color is an integer index into
+    the table instead of a call to matplotlib, and the same QColor object is
+    returned every time for the same entry. '''
+    def __init__(self, name, table):
+        self.name = name
+        self.table = table # array of shape (size, 4), dtype uint8
+        self.size = len(table)
+        self.colors = [QColor(r, g, b, a) for r, g, b, a in table.tolist()]
+
+    def index(self, values):
+        ''' Converts values from 0 to 1 (a number or an array of them) to
+        table indices, the same way matplotlib bins them. '''
+        i = np.asarray(values) * self.size
+        return np.clip(i, 0, self.size - 1).astype(np.intp)
+
+    def rgba(self, values):
+        ''' Returns the uint8 RGBA rows for an array of values from 0 to 1. '''
+        return self.table[self.index(values)]
+
+    def color(self, value):
+        ''' Returns the cached QColor for a single value from 0 to 1. '''
+        return self.lookup(value)[1]
+
+    def lookup(self, value):
+        ''' Returns the table index and cached QColor for a single value from
+        0 to 1. Timed as the "color" phase if the profiler is on. '''
+        start = perf_counter() if profiler.enabled else None
+        i = int(value * self.size) # plain Python is faster than numpy here
+        i = min(max(i, 0), self.size - 1)
+        if start is not None:
+            profiler.add("color", start)
+        return i, self.colors[i]
+
+cmap_cache = {} # Colormap objects, by (name, size)
+baked_tables = None # tables loaded from BAKED_FILE, if it exists
+
+def make_table(name, size = 256):
+    ''' Samples a matplotlib color map into a uint8 RGBA table. matplotlib is
+    slow to import, so it is only imported the first time it is needed. '''
+    from matplotlib import cm
+    values = cm.get_cmap(name)(np.linspace(0, 1, size))
+    return np.round(values * 255).astype(np.uint8)
+
+def get_cmap(name, size = 256):
+    ''' Returns the Colormap for the named color map, creating it the first
+    time it is asked for. Tables come from the baked file when it has them,
+    and from matplotlib otherwise. '''
+    global baked_tables
+    key = (name, size)
+    if key not in cmap_cache:
+        if baked_tables is None:
+            baked_tables = dict(np.load(BAKED_FILE)) if os.path.exists(BAKED_FILE) else {}
+        table = baked_tables.get("%s_%i" % key)
+        if table is None:
+            table = make_table(name, size)
+        cmap_cache[key] = Colormap(name, table)
+    return cmap_cache[key]
+
+def bake_cmaps(file_name = BAKED_FILE, sizes = (256, 1024)):
+    ''' Saves the tables of every color map in CMAP_NAMES (plus "jet") to a
+    file, so that get_cmap can run without matplotlib installed. '''
+    tables = {}
+    for name in set(CMAP_NAMES + ["jet"]):
+        for size in sizes:
+            tables["%s_%i" % (name, size)] = make_table(name, size)
+    np.savez_compressed(file_name, **tables)
 
 class Generator:
+    defaults = {} # names and default values of the model's parameters
+    # part of the cache key; bump it when the same parameters start drawing
+    # something different, so renders cached before are not used
+    version = 1
+
     def __init__(self, depth = 0, max_depth = 1,
                 go_func = None, step_func = None,
                 draw_func = None,
                 size = 1, cmap = None):
         self.depth = depth
         self.max_depth = max_depth
-        self.cmap = cm.get_cmap("jet")
+        self.cmap = get_cmap("jet")
         self.go_func = go_func
         self.step_func = step_func
         self.draw_func = draw_func
@@ -16,6 +109,40 @@ class Generator:
     def go(self):
         self.go_func(self)
 
+    def run(self):
+        ''' Runs go(), timing it as the "go" phase if the profiler is on. '''
+        if not profiler.enabled:
+            self.go()
+            return
+        start = perf_counter()
+        try:
+            self.go()
+        finally:
+            profiler.add("go", start)
+
+    def profile(self, file_name):
+        ''' Runs go() once and saves a profile of it: a trace-event JSON file
+        (for chrome://tracing or Perfetto) if the file name ends in .json, or
+        cProfile statistics (for pstats or snakeviz) otherwise. Returns the
+        profiler's summary of the run. '''
+        if file_name.lower().endswith(".json"):
+            profiler.start(trace = True)
+            try:
+                self.run()
+            finally:
+                profiler.stop()
+                profiler.save_trace(file_name)
+        else:
+            import cProfile
+            profile = cProfile.Profile()
+            profiler.start()
+            try:
+                profile.runcall(self.run)
+            finally:
+                profiler.stop()
+                profile.dump_stats(file_name)
+        return profiler.summary()
+
     def step(self): # may not be needed / makes "self" passing in implicit
         sleep(.1)
         self.step_func(self)
@@ -23,5 +150,72 @@ class Generator:
     def draw(self): # may not be needed / makes "self" passing in implicit
         self.draw_func(self)
 
+    def get_params(self):
+        ''' Returns the current values of the model's parameters. '''
+        return {name: getattr(self, name) for name in self.defaults}
+
+    def set_params(self, params):
+        ''' Sets model parameters from a dictionary without touching the
+        settings widgets, so a model can be configured headless. '''
+        for name, value in params.items():
+            if name not in self.defaults:
+                raise KeyError("%s has no parameter '%s'" % (type(self).__name__, name))
+            setattr(self, name, value)
+        self.update_params()
+
+    def update_params(self):
+        ''' Recomputes anything derived from the parameters after they change.
+        '''
+        pass
+
+    def estimate_primitives(self):
+        ''' Returns about how many primitives go() will draw, or None if the
+        model cannot tell. '''
+        return None
+
+    def set_quality(self, max_primitives):
+        ''' Lowers the model's quality so that go() draws about max_primitives
+        primitives at most, and returns how many it is then expected to draw.
+        This is only for previews: the settings are left alone, and a model
+        which cannot lower its quality draws in full. '''
+        return self.estimate_primitives()
+
+    def describe(self, w, h):
+        ''' Returns a dictionary of everything that decides which primitives
+        this model draws on a w x h canvas, or None if the drawing is not
+        repeatable, which is the case for a model with a seed parameter set
+        to None. Sizes are given as floats, so that the app's canvas size and
+        render.py's describe the same canvas the same way. '''
+        params = self.get_params()
+        if "seed" in params and params["seed"] is None:
+            return None
+        return {"model": type(self).__name__, "version": self.version,
+            "params": params, "w": float(w), "h": float(h)}
+
+    def geometry_key(self, w, h):
+        ''' Returns a canonical description (a JSON string) of the primitives
+        this model draws on a w x h canvas, for caching them as a geometry
+        file, or None if they are not repeatable. The background and scale
+        only change how the primitives are painted, so they are left out. '''
+        description = self.describe(w, h)
+        if description is None:
+            return None
+        return json.dumps(description, sort_keys = True)
+
+    def cache_key(self, w, h, bg_color, scale = 1):
+        ''' Returns a canonical description (a JSON string) of everything that
+        decides what this model draws on a w x h canvas, for caching renders,
+        or None if the drawing is not repeatable. '''
+        description = self.describe(w, h)
+        if description is None:
+            return None
+        description.update(bg_color = QColor(bg_color).name(QColor.HexArgb), scale = float(scale))
+        return json.dumps(description, sort_keys = True)
+
     # def __repr__(self):
     #     return "'%s' at depth %i of max %i" % (type(self).__name__, self.depth, self.max_depth)
+
+if __name__ == "__main__":
+    # bake the color tables: python -m objects.generator
+    bake_cmaps()
+    print("Color tables saved as %s" % BAKED_FILE)
@@ -0,0 +1,300 @@
+''' A compact binary file format for the shapes a model draws, so that a huge
+drawing only has to be generated once, and can then be re-rendered, re-colored
+or cropped without generating it again.
+
+A geometry file starts with the magic bytes b"PUPGEO1\0", a little-endian
+uint32 header length and a JSON header. The header records the model and
+parameters the drawing came from, the canvas it was drawn on, the color map
+and the number of primitives, plus the dtype and offset of each column. The
+columns follow, one per field in COLUMNS, each starting on a 64 byte boundary
+(counted from the end of the header) so that it can be opened directly with
+numpy.memmap. '''
+from PySide2.QtGui import QColor
+from PySide2.QtWidgets import *
+import numpy as np
+import json
+import os
+try:
+    from objects.generator import Generator, get_cmap, CMAP_NAMES
+    from objects.surface import RenderCancelled
+except:
+    from generator import Generator, get_cmap, CMAP_NAMES
+    from surface import RenderCancelled
+
+MAGIC = b"PUPGEO1\0"
+ALIGN = 64
+
+# the columns of a geometry file. "kind" is LINE or CIRCLE. A line runs from
+# (x1, y1) to (x2, y2) and "size" is its width; a circle is centered on
+# (x1, y1) and "size" is its radius. "depth" is how far into the generation
+# the model was, and "color" is the index into the color map table.
+COLUMNS = [("kind", "u1"), ("x1", "<f4"), ("y1", "<f4"), ("x2", "<f4"),
+    ("y2", "<f4"), ("size", "<f4"), ("depth", "<f4"), ("color", "<u2")]
+RECORD = np.dtype(COLUMNS)
+LINE, CIRCLE = 0, 1
+
+def aligned(n):
+    ''' Rounds n up to the next multiple of ALIGN. '''
+    return -(-n // ALIGN) * ALIGN
+
+class GeometryWriter:
+    ''' Writes a geometry file incrementally. Primitives are buffered in
+    chunks of "chunk_size" rows, and each full chunk is appended to one
+    temporary file per column, so memory use does not grow with the drawing.
+    close() joins the columns into the final file behind the header. '''
+    def __init__(self, file_name, info, chunk_size = 65536):
+        self.file_name = file_name
+        self.info = info # model, params, canvas and color map of the drawing
+        self.chunk_size = chunk_size
+        self.rows = []
+        self.count = 0
+        self.parts = {name: open("%s.%s.tmp" % (file_name, name), "wb") for name, _ in COLUMNS}
+
+    def add(self, kind, x1, y1, x2, y2, size, depth, color):
+        self.rows.append((kind, x1, y1, x2, y2, size, depth, color))
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        ''' Appends the buffered rows to the column files. '''
+        if self.rows:
+            chunk = np.array(self.rows, RECORD)
+            for name, _ in COLUMNS:
+                chunk[name].tofile(self.parts[name])
+            self.count += len(self.rows)
+            self.rows = []
+
+    def close(self):
+        ''' Writes the header, copies the columns in behind it and removes the
+        temporary files. '''
+        self.flush()
+        columns, offset = [], 0
+        for name, dtype in COLUMNS:
+            columns.append([name, dtype, offset])
+            offset = aligned(offset + self.count * np.dtype(dtype).itemsize)
+        header = json.dumps(dict(self.info, count = self.count, columns = columns)).encode()
+        with open(self.file_name, "wb") as f:
+            f.write(MAGIC)
+            f.write(np.uint32(len(header)).tobytes())
+            f.write(header)
+            start = aligned(f.tell())
+            for name, _, offset in columns:
+                part = self.parts[name]
+                part.close()
+                f.write(b"\0" * (start + offset - f.tell()))
+                with open(part.name, "rb") as src:
+                    while True:
+                        data = src.read(1 << 20)
+                        if not data:
+                            break
+                        f.write(data)
+                os.remove(part.name)
+
+    def discard(self):
+        ''' Removes the temporary files without writing the geometry file. '''
+        for part in self.parts.values():
+            part.close()
+            os.remove(part.name)
+
+def open_geometry(file_name):
+    ''' Returns the header of a geometry file, and a dict of its columns as
+    read-only memory-mapped arrays. Nothing is read from the columns until
+    they are indexed. '''
+    with open(file_name, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a geometry file" % file_name)
+        length = int(np.frombuffer(f.read(4), "<u4")[0])
+        header = json.loads(f.read(length).decode())
+    start = aligned(len(MAGIC) + 4 + length)
+    count = header["count"]
+    columns = {}
+    for name, dtype, offset in header["columns"]:
+        if count == 0: # numpy cannot map zero bytes
+            columns[name] = np.empty(0, dtype)
+        else:
+            columns[name] = np.memmap(file_name, dtype, "r", start + offset, (count,))
+    return header, columns
+
+def bounds(columns, rows):
+    ''' Returns the bounding boxes of the primitives in rows (a slice or an
+    array of row numbers), including their width or radius, as arrays of
+    left, top, right and bottom edges. '''
+    kind, x1, y1, x2, y2, size = (np.asarray(columns[name][rows])
+        for name in ("kind", "x1", "y1", "x2", "y2", "size"))
+    pad = np.where(kind == CIRCLE, size, size / 2)
+    return (np.minimum(x1, x2) - pad, np.minimum(y1, y2) - pad,
+        np.maximum(x1, x2) + pad, np.maximum(y1, y2) + pad)
+
+def draw_primitives(canvas, columns, rows, colors, scale = 1, dx = 0, dy = 0):
+    ''' Draws the primitives in rows (a slice or an array of row numbers, in
+    drawing order) on the canvas, scaled and then offset by (dx, dy). colors
+    is the color map's list of QColors. '''
+    kind, x1, y1, x2, y2, size, depth, color = (np.asarray(columns[name][rows]) for name, _ in COLUMNS)
+    rows = zip(kind.tolist(), (x1 * scale + dx).tolist(), (y1 * scale + dy).tolist(),
+        (x2 * scale + dx).tolist(), (y2 * scale + dy).tolist(), (size * scale).tolist(),
+        depth.tolist(), color.tolist())
+    for k, a, b, p, q, s, d, i in rows:
+        if k == LINE:
+            canvas.line(a, b, p, q, colors[i], s, depth = d, index = i)
+        else:
+            canvas.circle(a, b, s, colors[i], depth = d, index = i)
+
+class GeometrySurface:
+    ''' A drawing target with the same primitive methods as Surface, which
+    records the primitives into a geometry file instead of painting them.
+    Call close() once the model is done. '''
+    def __init__(self, file_name, w, h, bg_color, info):
+        self.w, self.h = w, h
+        self.cancelled = False
+        info = dict(info, w = w, h = h, bg_color = QColor(bg_color).name())
+        self.writer = GeometryWriter(file_name, info)
+
+    def line(self, x1, y1, x2, y2, color, width = 1, depth = 0, index = 0):
+        self.writer.add(LINE, x1, y1, x2, y2, width, depth, index)
+        self.drawn()
+
+    def circle(self, x, y, r, color, depth = 0, index = 0):
+        self.writer.add(CIRCLE, x, y, x, y, r, depth, index)
+        self.drawn()
+
+    def drawn(self):
+        if self.cancelled:
+            raise RenderCancelled()
+
+    def close(self):
+        self.writer.close()
+
+class GeometryTee(GeometrySurface):
+    ''' A GeometrySurface which also passes every primitive on to another
+    surface, so a drawing is painted and saved as geometry in one go. Call
+    close() once the model is done, or discard() if it failed. '''
+    def __init__(self, surface, file_name, info):
+        super().__init__(file_name, surface.w, surface.h, surface.bg_color, info)
+        self.surface = surface
+        self.file_name = file_name
+
+    def line(self, x1, y1, x2, y2, color, width = 1, depth = 0, index = 0):
+        self.writer.add(LINE, x1, y1, x2, y2, width, depth, index)
+        self.surface.line(x1, y1, x2, y2, color, width, depth, index)
+
+    def circle(self, x, y, r, color, depth = 0, index = 0):
+        self.writer.add(CIRCLE, x, y, x, y, r, depth, index)
+        self.surface.circle(x, y, r, color, depth, index)
+
+    def discard(self):
+        self.writer.discard()
+
+def geometry_info(model):
+    ''' Returns the part of a geometry file's header which describes the
+    model the drawing came from. '''
+    return {"model": type(model).__name__, "params": model.get_params(),
+        "cmap_name": model.cmap.name, "cmap_size": model.cmap.size}
+
+class Geometry(Generator):
+    ''' A model which draws a saved geometry file instead of generating a
+    drawing. The file is read a chunk at a time through numpy.memmap, so it
+    can be far bigger than memory.
+
+    The drawing (or the "crop" rectangle of it, [x, y, width, height] in the
+    coordinates it was drawn in) is scaled to fit the canvas and centered on
+    it. Only primitives which reach into the area shown are read. With a
+    cmap_name other than None, it is re-colored with that color map;
+    otherwise it keeps the color map it was drawn with. '''
+    defaults = {"file_name": None, "cmap_name": None, "crop": None}
+
+    def __init__(self, canvas, chunk_size = 65536):
+        self.canvas = canvas
+        self.chunk_size = chunk_size
+        self.depth = 0
+        self.header = None
+
+    def update_params(self):
+        ''' Checks the crop rectangle, and opens the geometry file, if one is
+        set. '''
+        if self.crop is not None and (len(self.crop) != 4 or self.crop[2] <= 0 or self.crop[3] <= 0):
+            raise ValueError("crop must be [x, y, width, height] with a positive width and height, not %r" % (self.crop,))
+        self.header, self.columns = None, {}
+        if self.file_name is not None:
+            self.header, self.columns = open_geometry(self.file_name)
+            name = self.cmap_name or self.header["cmap_name"]
+            self.cmap = get_cmap(name, self.header["cmap_size"])
+
+    def transform(self):
+        ''' Returns the area of the drawing to show, and the scale and offset
+        which fit it on the canvas. The crop rectangle is widened (or made
+        taller) around its center to the shape of the canvas, so the whole
+        canvas shows the drawing. '''
+        x, y, w, h = self.crop or (0, 0, self.header["w"], self.header["h"])
+        scale = min(self.canvas.w / w, self.canvas.h / h)
+        cw, ch = self.canvas.w / scale, self.canvas.h / scale
+        x, y = x + (w - cw) / 2, y + (h - ch) / 2
+        return (x, y, cw, ch), scale, -x * scale, -y * scale
+
+    def go(self):
+        ''' Draws every primitive of the file which is inside the crop
+        rectangle, in the order they were drawn. '''
+        if self.header is None:
+            print("No geometry file selected!")
+            return
+        (cx, cy, cw, ch), scale, dx, dy = self.transform()
+        for start in range(0, self.header["count"], self.chunk_size):
+            end = start + self.chunk_size
+            # skip primitives whose bounding box misses the crop rectangle
+            x0, y0, x1, y1 = bounds(self.columns, slice(start, end))
+            keep = (x0 <= cx + cw) & (x1 >= cx) & (y0 <= cy + ch) & (y1 >= cy)
+            draw_primitives(self.canvas, self.columns, start + np.flatnonzero(keep),
+                self.cmap.colors, scale, dx, dy)
+
+    def describe(self, w, h):
+        ''' Like Generator.describe, but also changes when the file does. '''
+        if self.file_name is None:
+            return None
+        description = super().describe(w, h)
+        st = os.stat(self.file_name)
+        description["file"] = [st.st_size, st.st_mtime]
+        return description
+
+    def geometry_key(self, w, h):
+        ''' The drawing already is a geometry file, so it is not cached as
+        one again. '''
+        return None
+
+    def init_menu_layout(self):
+        ''' create a menu layout for opening a geometry file and choosing how
+        to draw it. '''
+        l = QGridLayout()
+        self.open_button = QPushButton("Open...")
+        self.open_button.clicked.connect(self.open_file)
+        self.file_label = QLabel("No file")
+        self.file_label.setWordWrap(True)
+        self.cmap_label = QLabel("Color map:")
+        self.cmap_box = QComboBox()
+        self.cmap_box.addItems(["As drawn"] + CMAP_NAMES)
+        self.cmap_box.activated[int].connect(self.set_cmap)
+        l.addWidget(self.open_button, 0, 0)
+        l.addWidget(self.file_label, 0, 1)
+        l.addWidget(self.cmap_label, 1, 0)
+        l.addWidget(self.cmap_box, 1, 1)
+        self.reset()
+        return l
+
+    def reset(self):
+        ''' Forgets the file and color map. '''
+        self.cmap_box.setCurrentIndex(0)
+        self.file_label.setText("No file")
+        self.set_params(self.defaults)
+
+    def open_file(self):
+        file_name, _ = QFileDialog.getOpenFileName(None, "Open Geometry", "", "Geometry files (*.geo)")
+        if file_name:
+            try:
+                self.set_params({"file_name": file_name})
+            except (OSError, ValueError) as e:
+                print("Could not open %s: %s" % (file_name, e))
+                self.set_params({"file_name": None})
+                return
+            self.file_label.setText("%s\n%s, %i shapes" % (os.path.basename(file_name),
+                self.header["model"], self.header["count"]))
+
+    def set_cmap(self, i):
+        self.set_params({"cmap_name": CMAP_NAMES[i - 1] if i > 0 else None})
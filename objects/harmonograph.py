@@ -1,21 +1,28 @@
-from PySide2.QtGui import QColor, QPainter, QPen
-from PySide2.QtCore import QPoint, Qt
+from PySide2.QtCore import Qt
 from PySide2.QtWidgets import *
 from time import sleep
-from matplotlib import cm
 import numpy as np
 from random import randint, random
 try:
-    from objects.generator import Generator
+    from objects.generator import Generator, get_cmap, CMAP_NAMES
 except:
-    from generator import Generator
+    from generator import Generator, get_cmap, CMAP_NAMES
 
 class Harmonograph(Generator):
+    # model parameters and their default values. Phases are in radians and
+    # decays are negative, as used by pos().
+    defaults = {"cmap_name": "viridis", "pen_size": 5,
+        "p1": True, "amp1": 300, "freq1": 2, "phase1": 0, "decay1": -.002,
+        "p2": False, "amp2": 150, "freq2": 4, "phase2": 0, "decay2": -.002,
+        "p3": True, "amp3": 300, "freq3": 2, "phase3": 0, "decay3": -.002,
+        "p4": False, "amp4": 150, "freq4": 4, "phase4": 0, "decay4": -.002}
+
     def __init__(self, canvas):
         self.canvas = canvas
         self.x0 = canvas.w // 2
         self.y0 = canvas.h // 2
         self.depth = 0
+        self.step_size = .01 # time between samples; set_quality makes it coarser
 
     def step(self): # calculates parameters of current state
         if self.depth == 0:
@@ -25,7 +32,7 @@ class Harmonograph(Generator):
             self.curr_x, self.curr_y = self.pos(self.depth)
             self.calc_color()
             self.draw()
-        self.depth += .01
+        self.depth += self.step_size
 
     def go(self): # propels model forward
         self.running = True
@@ -34,13 +41,17 @@ class Harmonograph(Generator):
             if self.depth > 100:
                 self.running = False
 
+    def estimate_primitives(self):
+        return int(100 / self.step_size)
+
+    def set_quality(self, max_primitives):
+        ''' Takes fewer samples of the curve, down to 500. '''
+        self.step_size = max(.01, 100 / max(max_primitives, 500))
+        return self.estimate_primitives()
+
     def draw(self): # draws current state
-        p = QPainter(self.canvas.pixmap())
-        pen = QPen(self.color, self.pen_size)
-        p.setPen(pen)
-        p.drawLine(self.prev_x, self.prev_y, self.curr_x, self.curr_y)
-        p.end()
-        self.canvas.repaint()
+        self.canvas.line(self.prev_x, self.prev_y, self.curr_x, self.curr_y, self.color, self.pen_size,
+            depth = self.depth, index = self.color_index)
 
     def pos(self, t): # calculate position based on parent's position
         p1 = self.amp1 * (np.e ** (self.decay1 * t) * np.cos(t * self.freq1 + self.phase1))
@@ -62,8 +73,7 @@ class Harmonograph(Generator):
         frac = val % 1
         if int(val) % 2 == 1:
             frac = 1-frac
-        r, g, b, a = self.cmap(frac)
-        self.color = QColor(r * 255, g * 255, b * 255)
+        self.color_index, self.color = self.cmap.lookup(frac)
         return self.color
 
     def randomize(self):
@@ -180,13 +190,7 @@ class Harmonograph(Generator):
         l = QGridLayout()
         self.cmap_label = QLabel("Color map:")
         self.cmap_box = QComboBox()
-        self.cmap_box.addItems(['viridis', 'plasma', 'inferno', 'magma', 'gray', 'bone', 'pink',
-            'spring', 'summer', 'autumn', 'winter', 'cool', 'Wistia',
-            'hot', 'afmhot', 'gist_heat', 'copper', 'PiYG', 'PRGn', 'BrBG', 'PuOr', 'RdGy', 'RdBu',
-            'RdYlBu', 'RdYlGn', 'Spectral', 'coolwarm', 'bwr', 'seismic', 'twilight', 'twilight_shifted', 'hsv',
-             'ocean', 'gist_earth', 'terrain', 'gist_stern',
-            'gnuplot', 'gnuplot2', 'CMRmap', 'cubehelix', 'brg',
-            'gist_rainbow', 'rainbow', 'jet', 'nipy_spectral', 'gist_ncar'])
+        self.cmap_box.addItems(CMAP_NAMES)
         self.size_label = QLabel("Pen size:")
         self.size_box = QSpinBox()
         l.addWidget(self.cmap_label, 0, 0)
@@ -203,13 +207,11 @@ class Harmonograph(Generator):
     def reset(self):
         self.cmap_box.setCurrentIndex(0)
         self.cmap_box.activated[str].connect(self.set_cmap)
-        self.cmap = cm.get_cmap("viridis")
 
         self.size_box.setMinimum(1)
         self.size_box.setMaximum(100)
         self.size_box.setValue(5)
         self.size_box.valueChanged.connect(self.set_size)
-        self.pen_size = 5
 
         self.p1_group.clicked.connect(self.toggle_p1)
         self.amp1_box.valueChanged.connect(self.set_amp1)
@@ -220,11 +222,6 @@ class Harmonograph(Generator):
         self.phase1_box.setMinimum(0); self.phase1_box.setMaximum(180); self.phase1_box.setValue(0)
         self.decay1_box.valueChanged.connect(self.set_decay1)
         self.decay1_box.setMinimum(0); self.decay1_box.setMaximum(.01); self.decay1_box.setValue(.002)
-        self.p1 = True
-        self.amp1 = 300
-        self.freq1 = 2
-        self.phase1 = 0
-        self.decay1 = -.002
 
         self.p2_group.clicked.connect(self.toggle_p2)
         self.amp2_box.valueChanged.connect(self.set_amp2)
@@ -235,11 +232,6 @@ class Harmonograph(Generator):
         self.phase2_box.setMinimum(0); self.phase2_box.setMaximum(180); self.phase2_box.setValue(0)
         self.decay2_box.valueChanged.connect(self.set_decay2)
         self.decay2_box.setMinimum(0); self.decay2_box.setMaximum(.01); self.decay2_box.setValue(.002)
-        self.p2 = False
-        self.amp2 = 150
-        self.freq2 = 4
-        self.phase2 = 0
-        self.decay2 = -.002
 
         self.p3_group.clicked.connect(self.toggle_p3)
         self.amp3_box.valueChanged.connect(self.set_amp3)
@@ -250,11 +242,6 @@ class Harmonograph(Generator):
         self.phase3_box.setMinimum(0); self.phase3_box.setMaximum(180); self.phase3_box.setValue(0)
         self.decay3_box.valueChanged.connect(self.set_decay3)
         self.decay3_box.setMinimum(0); self.decay3_box.setMaximum(.01); self.decay3_box.setValue(.002)
-        self.p3 = True
-        self.amp3 = 300
-        self.freq3 = 2
-        self.phase3 = 0
-        self.decay3 = -.002
 
         self.p4_group.clicked.connect(self.toggle_p4)
         self.amp4_box.valueChanged.connect(self.set_amp4)
@@ -265,11 +252,11 @@ class Harmonograph(Generator):
         self.phase4_box.setMinimum(0); self.phase4_box.setMaximum(180); self.phase4_box.setValue(0)
         self.decay4_box.valueChanged.connect(self.set_decay4)
         self.decay4_box.setMinimum(0); self.decay4_box.setMaximum(.01); self.decay4_box.setValue(.002)
-        self.p4 = False
-        self.amp4 = 150
-        self.freq4 = 4
-        self.phase4 = 0
-        self.decay4 = -.002
+
+        self.set_params(self.defaults)
+
+    def update_params(self):
+        self.cmap = get_cmap(self.cmap_name)
 
     def toggle_p1(self, state):
         self.p1 = state
@@ -332,7 +319,8 @@ class Harmonograph(Generator):
         self.decay4 = -n
 
     def set_cmap(self, name):
-        self.cmap = cm.get_cmap(name)
+        self.cmap_name = name
+        self.cmap = get_cmap(name)
 
     def set_size(self, n):
         self.pen_size = n
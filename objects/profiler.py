@@ -0,0 +1,87 @@
+from collections import defaultdict
+from threading import get_ident
+from time import perf_counter
+import json
+
+class Profiler:
+    ''' Per-phase timers and counters, for finding out where a render spends
+    its time.
+
+    Code being measured checks "enabled" before timing anything, so while the
+    profiler is off the only cost is that check. The phases are:
+
+    go       a whole run of a model (Generator.run)
+    color    looking up colors in a color map (Colormap.lookup)
+    paint    drawing primitives with QPainter (Surface.line and circle)
+    begin    creating a QPainter on the surface, part of "paint"
+             (Surface.begin)
+    present  copying a drawn frame off the surface (Surface.present)
+    swap     copying a frame into the canvas buffer (Canvas.swap)
+    repaint  painting the canvas on screen (Canvas.paintEvent)
+
+    and "compute", the model's own geometry math, is what is left of "go".
+    Each phase also counts how often it happened, and other events (cache
+    hits) are only counted. If tracing, every timed event is also kept (up to
+    max_events), to be saved as a trace-event JSON file for chrome://tracing
+    or Perfetto. '''
+    def __init__(self, max_events = 1000000):
+        self.enabled = False
+        self.max_events = max_events
+        self.events = None # timed events, if tracing
+        self.reset()
+
+    def start(self, trace = False):
+        ''' Clears the measurements and starts profiling. '''
+        self.events = [] if trace else None
+        self.reset()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def reset(self):
+        ''' Clears the measurements. '''
+        self.times = defaultdict(float) # seconds, by phase
+        self.counts = defaultdict(int) # events, by phase or name
+        self.origin = perf_counter()
+        if self.events is not None:
+            self.events = []
+
+    def add(self, phase, start, end = None):
+        ''' Adds the time from start to end (or now) to a phase. '''
+        if end is None:
+            end = perf_counter()
+        self.times[phase] += end - start
+        self.counts[phase] += 1
+        if self.events is not None and len(self.events) < self.max_events:
+            self.events.append((phase, start, end - start, get_ident()))
+
+    def count(self, name, n = 1):
+        self.counts[name] += n
+
+    def summary(self):
+        ''' Returns lines describing the measurements so far. '''
+        t, n = dict(self.times), dict(self.counts) # other threads may add to them
+        ms = lambda phase: 1000 * t.get(phase, 0)
+        compute = max(ms("go") - ms("color") - ms("paint") - ms("present"), 0)
+        return ["go %.0f ms: compute %.0f, color %.1f, paint %.0f, present %.0f" % (ms("go"),
+                compute, ms("color"), ms("paint"), ms("present")),
+            "%i primitives, %i frames, %i painters (%.1f ms)" % (n.get("paint", 0), n.get("present", 0),
+                n.get("begin", 0), ms("begin")),
+            "swap %.1f ms (%i), repaint %.1f ms (%i)" % (ms("swap"), n.get("swap", 0), ms("repaint"), n.get("repaint", 0)),
+            "cache: %i hits, %i misses; geometry: %i hits, %i misses" % (n.get("cache hits", 0),
+                n.get("cache misses", 0), n.get("geometry cache hits", 0), n.get("geometry cache misses", 0))]
+
+    def save_trace(self, file_name):
+        ''' Saves the events kept while tracing in the trace-event format. '''
+        threads = {}
+        events = []
+        for phase, start, duration, thread in self.events or []:
+            events.append({"name": phase, "ph": "X", "pid": 1,
+                "tid": threads.setdefault(thread, len(threads) + 1),
+                "ts": 1e6 * (start - self.origin), "dur": 1e6 * duration})
+        with open(file_name, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+# the profiler everything reports to; off until started
+profiler = Profiler()
@@ -0,0 +1,46 @@
+from copy import copy
+
+class QualityController:
+    ''' Scales down interactive renders so that they finish within a time
+    budget.
+
+    What one primitive costs (the model's computing plus the painting) is
+    measured from every finished render, as a moving average for each kind of
+    model. Before a preview, the number of primitives which fit in the budget
+    at that cost is worked out, and a copy of the model is asked to lower its
+    quality (see Generator.set_quality) to draw no more than that. Final
+    renders (exports, recordings and render.py) do not go through here, so
+    they are always drawn in full. '''
+    def __init__(self, budget = .25, default_cost = 20e-6, smoothing = .5):
+        self.budget = budget # seconds an interactive render may take
+        self.default_cost = default_cost # seconds per primitive, until measured
+        self.smoothing = smoothing # weight of the newest measurement
+        self.costs = {} # measured seconds per primitive, by model name
+
+    def cost(self, model):
+        return self.costs.get(type(model).__name__, self.default_cost)
+
+    def measure(self, model, primitives, seconds):
+        ''' Records how long a render of the model took to draw the given
+        number of primitives. The time has to be spent on those primitives
+        alone: a model lowering its quality leaves out the work of what it
+        does not draw (as Branch does with the nodes below its depth limit),
+        so previews and full renders cost the same per primitive. '''
+        if primitives > 0:
+            name = type(model).__name__
+            cost = seconds / primitives
+            old = self.costs.get(name)
+            self.costs[name] = cost if old is None else old + self.smoothing * (cost - old)
+
+    def preview(self, model):
+        ''' Returns a copy of the model set up to draw within the budget, and
+        the fraction of the full drawing it is expected to draw (1 if the
+        whole drawing fits). '''
+        model = copy(model)
+        full = model.estimate_primitives()
+        if not full:
+            return model, 1
+        budget = int(self.budget / self.cost(model))
+        if full <= budget:
+            return model, 1
+        return model, model.set_quality(budget) / full
@@ -0,0 +1,181 @@
+from PySide2.QtGui import QImage, QPainter
+from queue import Queue
+from threading import Thread
+import numpy as np
+import struct
+import zlib
+import os
+try:
+    from objects.surface import Surface
+    from objects.export import image_to_array
+except:
+    from surface import Surface
+    from export import image_to_array
+
+class FrameSequenceWriter:
+    ''' Saves every frame as its own image file. The file name is a pattern
+    with a % field for the frame number, like "frames/tree%05d.png". '''
+    def __init__(self, pattern, fps):
+        self.pattern = pattern
+        self.count = 0
+        folder = os.path.dirname(pattern)
+        if folder:
+            os.makedirs(folder, exist_ok = True)
+
+    def write(self, image):
+        self.count += 1
+        file_name = self.pattern % self.count
+        if not image.save(file_name):
+            raise IOError("Could not save %s" % file_name)
+
+    def close(self):
+        pass
+
+class APNGWriter:
+    ''' Writes an animated PNG one frame at a time. Only the rectangle which
+    changed since the previous frame is stored, drawn over what is already
+    there, so frames of a drawing being built up stay small. The frame count
+    is filled in when the file is closed. '''
+    def __init__(self, file_name, fps):
+        self.f = open(file_name, "wb")
+        self.delay = (1, int(fps)) # seconds per frame, as a fraction
+        self.sequence = 0 # APNG chunk sequence number
+        self.frames = 0
+        self.previous = None # pixels of the previous frame
+
+    def chunk(self, kind, data):
+        self.f.write(struct.pack(">I", len(data)) + kind + data)
+        self.f.write(struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    def compress(self, pixels):
+        h, w = pixels.shape[:2]
+        lines = np.zeros((h, 1 + w * 3), np.uint8) # filter byte 0 (none)
+        lines[:, 1:] = pixels.reshape(h, -1)
+        return zlib.compress(lines.tobytes(), 6)
+
+    def write(self, image):
+        pixels = image_to_array(image)
+        h, w = pixels.shape[:2]
+        if self.previous is None:
+            self.f.write(b"\x89PNG\r\n\x1a\n")
+            self.chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0))
+            self.actl = self.f.tell() # acTL is patched with the frame count
+            self.chunk(b"acTL", struct.pack(">II", 0, 0))
+            x, y = 0, 0
+        else:
+            changed = (pixels != self.previous).any(axis = 2)
+            rows, cols = np.flatnonzero(changed.any(axis = 1)), np.flatnonzero(changed.any(axis = 0))
+            if len(rows):
+                y, x = rows[0], cols[0]
+                pixels = pixels[y:rows[-1] + 1, x:cols[-1] + 1]
+            else: # nothing changed; repeat one pixel
+                y, x = 0, 0
+                pixels = pixels[:1, :1]
+        # fcTL: frame size and offset, delay, dispose op NONE, blend op SOURCE
+        ph, pw = pixels.shape[:2]
+        self.chunk(b"fcTL", struct.pack(">IIIIIHHBB", self.sequence, pw, ph, x, y,
+            self.delay[0], self.delay[1], 0, 0))
+        self.sequence += 1
+        data = self.compress(pixels)
+        if self.previous is None:
+            self.chunk(b"IDAT", data)
+        else:
+            self.chunk(b"fdAT", struct.pack(">I", self.sequence) + data)
+            self.sequence += 1
+        self.previous = image_to_array(image)
+        self.frames += 1
+
+    def close(self):
+        if self.previous is not None:
+            self.chunk(b"IEND", b"")
+            self.f.seek(self.actl)
+            self.chunk(b"acTL", struct.pack(">II", self.frames, 0)) # loop forever
+        self.f.close()
+
+def make_writer(file_name, fps):
+    ''' A file name with a % field records a frame sequence; anything else is
+    recorded as an animated PNG. '''
+    if "%" in file_name:
+        return FrameSequenceWriter(file_name, fps)
+    return APNGWriter(file_name, fps)
+
+class Recorder:
+    ''' Records the drawing of a model as an animation.
+
+    Frames are captured every "primitives_per_frame" primitives, rather than
+    by wall-clock time, so the animation plays at the same pace however fast
+    the render runs; fps only sets the playback speed. Captured frames are
+    handed through a bounded queue to a writer thread, which encodes them.
+    Memory use is therefore at most queue_size frames, however long the
+    animation is; the drawing only waits if the writer falls that far behind.
+    If a background color is given, the writer thread lays every frame over
+    it, for recording a drawing made on a transparent surface.
+    '''
+    def __init__(self, file_name, fps = 30, primitives_per_frame = 50, queue_size = 8, background = None):
+        self.file_name = file_name
+        self.primitives_per_frame = primitives_per_frame
+        self.background = background
+        self.writer = make_writer(file_name, fps)
+        self.queue = Queue(queue_size)
+        self.error = None
+        self.thread = Thread(target = self.write_frames, daemon = True)
+        self.thread.start()
+
+    def add_frame(self, image):
+        ''' Queues a copy of the image as the next frame. '''
+        self.queue.put(image.copy())
+
+    def flatten(self, image):
+        ''' Returns the image laid over the background, if there is one. '''
+        if self.background is None:
+            return image
+        frame = QImage(image.size(), image.format())
+        frame.fill(self.background)
+        p = QPainter(frame)
+        p.drawImage(0, 0, image)
+        p.end()
+        return frame
+
+    def write_frames(self):
+        ''' Runs on the writer thread: encodes frames until None is queued. If
+        writing fails, the rest of the frames are thrown away. '''
+        while True:
+            image = self.queue.get()
+            if image is None:
+                break
+            if self.error is None:
+                try:
+                    self.writer.write(self.flatten(image))
+                except Exception as e:
+                    self.error = e
+        try:
+            self.writer.close()
+        except Exception as e:
+            self.error = self.error or e
+
+    def close(self):
+        ''' Waits for every queued frame to be written and closes the file.
+        Raises any error the writer ran into. '''
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+class RecordingSurface(Surface):
+    ''' A Surface which hands a frame to a recorder after every so many
+    primitives. Call finish() once the model is done, to record the final
+    frame and close the recording. '''
+    def __init__(self, w, h, bg_color, recorder, **kwargs):
+        super().__init__(w, h, bg_color, **kwargs)
+        self.recorder = recorder
+
+    def drawn(self):
+        super().drawn()
+        if self.primitives % self.recorder.primitives_per_frame == 0:
+            self.end()
+            self.recorder.add_frame(self.image)
+
+    def finish(self):
+        self.end()
+        self.recorder.add_frame(self.image)
+        self.recorder.close()
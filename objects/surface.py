@@ -0,0 +1,131 @@
+from PySide2.QtGui import QImage, QPainter, QPen
+from PySide2.QtCore import QPointF, QLineF, QRect, QRectF, Qt
+from time import perf_counter
+try:
+    from objects.profiler import profiler
+except:
+    from profiler import profiler
+
+class RenderCancelled(Exception):
+    ''' Raised from inside a model's drawing loop when the render it belongs to
+    has been superseded, so that the generation unwinds right away. '''
+    pass
+
+class Surface:
+    ''' An off-screen drawing target for models. It has the same size
+    attributes as the canvas, but paints into a QImage, which (unlike the
+    canvas pixmap) can safely be drawn on outside of the GUI thread.
+
+    Models draw through the primitive methods (line, circle) rather than
+    making their own painters. One painter is kept open between primitives,
+    and the area each primitive covers is added to a dirty rectangle. Every
+    "interval" seconds the dirty part of the image is copied and handed to the
+    present function, so that gradual generation can still be watched at a
+    cost proportional to what was drawn.
+
+    Models always draw in w x h canvas coordinates; a scale other than 1
+    renders the same drawing at a higher (or lower) resolution. If a tile
+    (a QRect in scaled pixels) is given, the image only holds that part of
+    the drawing, and primitives which fall outside of it are skipped. '''
+    def __init__(self, w, h, bg_color = Qt.white, present = None, interval = 1 / 30, scale = 1, tile = None):
+        self.w, self.h = w, h
+        self.scale = scale
+        self.bg_color = bg_color
+        if tile is None:
+            tile = QRect(0, 0, int(w * scale), int(h * scale))
+        self.tile = tile
+        self.image = QImage(tile.width(), tile.height(), QImage.Format_ARGB32_Premultiplied)
+        self.image.fill(bg_color)
+        self.bounds = self.image.rect()
+        self.present_func = present
+        self.interval = interval
+        self.cancelled = False
+        self.painter = None
+        self.pen = None # color and width of the painter's pen
+        self.dirty = QRect() # area drawn since the last present
+        self.last_present = perf_counter()
+        self.primitives = 0 # primitives drawn so far
+
+    def begin(self):
+        ''' Returns the open painter for the image, creating it if needed.
+        Creating one is timed as the "begin" phase if the profiler is on. '''
+        if self.painter is None:
+            start = perf_counter() if profiler.enabled else None
+            self.painter = QPainter(self.image)
+            self.painter.translate(-self.tile.x(), -self.tile.y())
+            self.painter.scale(self.scale, self.scale)
+            if start is not None:
+                profiler.add("begin", start)
+        return self.painter
+
+    def end(self):
+        ''' Finishes any painting in progress, so the image can be read. '''
+        if self.painter is not None:
+            self.painter.end()
+            self.painter = None
+            self.pen = None
+
+    def map_rect(self, rect):
+        ''' Converts a rectangle in canvas coordinates to image pixels. '''
+        s = self.scale
+        rect = QRectF(rect.x() * s - self.tile.x(), rect.y() * s - self.tile.y(),
+            rect.width() * s, rect.height() * s)
+        return rect.toAlignedRect()
+
+    def line(self, x1, y1, x2, y2, color, width = 1, depth = 0, index = 0):
+        ''' Draws a line segment in the given color and pen width. The depth
+        (how far into the generation the model was) and color map index are
+        only used by surfaces which record geometry. '''
+        start = perf_counter() if profiler.enabled else None
+        pad = width / 2 + 1
+        rect = self.map_rect(QRectF(QPointF(x1, y1), QPointF(x2, y2)).normalized().adjusted(-pad, -pad, pad, pad))
+        if rect.intersects(self.bounds):
+            p = self.begin()
+            # consecutive segments often share a color, so only change the pen
+            # when the color or width does
+            if self.pen != (color, width):
+                p.setPen(QPen(color, width))
+                self.pen = (color, width)
+            p.drawLine(QLineF(x1, y1, x2, y2))
+            self.dirty = self.dirty.united(rect)
+        if start is not None:
+            profiler.add("paint", start)
+        self.drawn()
+
+    def circle(self, x, y, r, color, depth = 0, index = 0):
+        ''' Draws a filled circle of radius r centered on (x, y). '''
+        start = perf_counter() if profiler.enabled else None
+        rect = self.map_rect(QRectF(x - r - 1, y - r - 1, 2 * r + 2, 2 * r + 2))
+        if rect.intersects(self.bounds):
+            p = self.begin()
+            p.setPen(color)
+            p.setBrush(color)
+            self.pen = None
+            p.drawEllipse(QPointF(x, y), r, r)
+            self.dirty = self.dirty.united(rect)
+        if start is not None:
+            profiler.add("paint", start)
+        self.drawn()
+
+    def drawn(self):
+        ''' Called after every primitive: stops the render if it has been
+        cancelled, and presents the image if enough time has passed. '''
+        if self.cancelled:
+            raise RenderCancelled()
+        self.primitives += 1
+        if self.present_func is not None and perf_counter() - self.last_present >= self.interval:
+            self.present()
+
+    def present(self):
+        ''' Hands a copy of the dirty part of the image, and where it belongs,
+        to the present function. The copy is the front buffer; drawing
+        continues on this surface's image. '''
+        self.end()
+        self.last_present = start = perf_counter()
+        dirty = self.dirty.intersected(self.bounds)
+        self.dirty = QRect()
+        if self.present_func is not None and not dirty.isEmpty():
+            frame = self.image.copy(dirty)
+            if profiler.enabled:
+                profiler.add("present", start)
+            self.present_func(frame, dirty)
@@ -0,0 +1,166 @@
+from PySide2.QtCore import QThread, QRect, Signal
+from PySide2.QtGui import QImage
+from copy import copy
+from time import perf_counter
+from multiprocessing import get_context, TimeoutError
+try:
+    from objects.surface import Surface, RenderCancelled
+    from objects.export import make_export
+    from objects.recorder import RecordingSurface
+    from objects.geometry import GeometryTee, geometry_info
+    from objects.gallery import init_process, render_thumbnail, to_image
+except:
+    from surface import Surface, RenderCancelled
+    from export import make_export
+    from recorder import RecordingSurface
+    from geometry import GeometryTee, geometry_info
+    from gallery import init_process, render_thumbnail, to_image
+
+class RenderWorker(QThread):
+    ''' Runs one model's generation and drawing on a background thread.
+
+    The worker draws a snapshot (shallow copy) of the model, so the settings
+    panel can keep changing the live model without affecting a render in
+    progress. Frames are emitted with the job number they belong to; the
+    window compares it with its current job and drops frames from stale jobs.
+    Each frame only holds the area drawn since the previous one, along with
+    the rectangle of the canvas it covers. If a recorder is given, the
+    drawing is also recorded as an animation. If a cache and key are given,
+    the finished image is stored in the cache (from the worker thread, so
+    the GUI does not wait for the file to be written). If a geometry key is
+    given too, the primitives are also saved to the cache as a geometry
+    file, so the drawing can later be painted again without generating it.
+    If a quality controller is given, it is told how long the render took.
+    '''
+    frame_ready = Signal(int, QImage, QRect) # newly drawn area while drawing
+
+    def __init__(self, job_id, model, w, h, bg_color, recorder = None, cache = None, cache_key = None, quality = None, geometry_key = None):
+        super().__init__()
+        self.job_id = job_id
+        self.recorder = recorder
+        self.cache = cache
+        self.cache_key = cache_key
+        self.geometry_key = geometry_key
+        self.quality = quality
+        self.layer = None # name of the canvas layer the frames are for
+        if recorder is None:
+            self.surface = Surface(w, h, bg_color, present = self.emit_frame)
+        else:
+            self.surface = RecordingSurface(w, h, bg_color, recorder, present = self.emit_frame)
+        self.model = copy(model)
+        self.model.canvas = self.surface
+        self.geometry = None
+        if cache is not None and geometry_key is not None:
+            self.geometry = GeometryTee(self.surface, cache.temp_name(geometry_key, ".geo"), geometry_info(model))
+            self.model.canvas = self.geometry
+
+    def run(self):
+        ''' Generates the model on the off-screen surface (in the worker
+        thread), then sends the last frame. If the render is cancelled or the
+        model fails, the painter and any recording are still closed, and the
+        error is printed. '''
+        start = perf_counter()
+        finished = False
+        try:
+            self.model.run()
+            finished = True
+        except RenderCancelled:
+            pass
+        except Exception as e:
+            print("Error drawing %s: %s: %s" % (type(self.model).__name__, type(e).__name__, e))
+        finally:
+            self.surface.end() # the painter may still be open on the image
+            if not finished and self.recorder is not None:
+                self.finish_recording(self.recorder.close)
+            if not finished and self.geometry is not None:
+                self.geometry.discard()
+        if not finished:
+            return
+        if self.quality is not None: # previews included, see QualityController.measure
+            self.quality.measure(self.model, self.surface.primitives, perf_counter() - start)
+        self.surface.present() # send whatever was drawn since the last frame
+        if self.recorder is not None:
+            self.finish_recording(self.surface.finish)
+        if self.cache is not None:
+            self.cache.put(self.cache_key, self.surface.image)
+        if self.geometry is not None:
+            self.geometry.close()
+            self.cache.put_geometry(self.geometry_key, self.geometry.file_name)
+
+    def finish_recording(self, finish):
+        ''' Closes the recording, reporting whether it was saved. '''
+        try:
+            finish()
+            print("Animation saved as %s" % self.recorder.file_name)
+        except Exception as e:
+            print("Error recording %s: %s" % (self.recorder.file_name, e))
+
+    def emit_frame(self, image, rect):
+        self.frame_ready.emit(self.job_id, image, rect)
+
+    def cancel(self):
+        ''' Stops the render at the next primitive it draws. '''
+        self.surface.cancelled = True
+
+class ExportWorker(QThread):
+    ''' Runs an export (see make_export) on a background thread, reporting
+    its progress as it goes: a tiled export counts its tiles, while one
+    written in a single pass (SVG, geometry) only reports (0, 0) when it
+    starts and (1, 1) when it is done. When it ends, "done" is emitted with
+    an error message, which is empty if the export succeeded. '''
+    progress = Signal(int, int) # done, total
+    done = Signal(str)
+
+    def __init__(self, model, w, h, file_name, scale, bg_color):
+        super().__init__()
+        self.export = make_export(model, w, h, file_name, scale, bg_color)
+
+    def run(self):
+        try:
+            self.export.run(self.progress.emit)
+        except RenderCancelled:
+            self.done.emit("Export cancelled")
+        except Exception as e:
+            self.done.emit("%s: %s" % (type(e).__name__, e))
+        else:
+            self.done.emit("")
+
+    def cancel(self):
+        self.export.cancel()
+
+class GalleryWorker(QThread):
+    ''' Renders thumbnail jobs (see objects/gallery.py) in a pool of
+    processes, emitting each one as soon as it is done, in whatever order
+    they finish. Cancelling stops the pool within a tenth of a second. '''
+    thumbnail_ready = Signal(object, object, QImage) # job, parameters, image
+
+    def __init__(self, jobs, processes = None):
+        super().__init__()
+        self.jobs = jobs
+        self.processes = processes
+        self.cancelled = False
+
+    def run(self):
+        # spawn rather than fork, so each process starts Qt from scratch
+        pool = get_context("spawn").Pool(self.processes, init_process)
+        results = pool.imap_unordered(render_thumbnail, self.jobs)
+        try:
+            for i in range(len(self.jobs)):
+                while not self.cancelled:
+                    try:
+                        job, params, data = results.next(timeout = .1)
+                        break
+                    except TimeoutError:
+                        pass
+                if self.cancelled:
+                    break
+                self.thumbnail_ready.emit(job, params, to_image(data))
+        except Exception as e:
+            print("Error rendering gallery: %s: %s" % (type(e).__name__, e))
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def cancel(self):
+        ''' Stops the gallery, throwing away thumbnails still being drawn. '''
+        self.cancelled = True
@@ -0,0 +1,201 @@
+''' Renders models to image files without opening a window.
+
+Render one image, with parameters from a JSON (or YAML) file:
+
+    python render.py Branch -p tree.json -o tree.png --scale 4
+
+Or render every job in a job file, spread over a pool of processes:
+
+    python render.py --jobs jobs.json --processes 8
+
+A job file holds a list of jobs. Each job is a dictionary with a "model" name,
+an "output" file, and optionally "params", "width", "height", "scale",
+"background" and "tiled"; anything left out is taken from the command line
+options. With "tiled" (or --tiled), the image is rendered in tiles and streamed
+to a PNG or TIFF file, so very large images fit in memory:
+
+    python render.py Harmonograph -o poster.tif --scale 16 --tiled
+
+An output file ending in .svg is always streamed as a vector drawing, and one
+ending in .geo saves the shapes drawn to a geometry file. The Geometry model
+draws such a file again, optionally re-colored or cropped, without generating
+the drawing again:
+
+    python render.py Branch -p tree.json -o tree.geo
+    python render.py Geometry -p recolor.json -o tree.png --scale 4
+
+where recolor.json is like {"file_name": "tree.geo", "cmap_name": "magma"}.
+
+With "record" (or --record), the drawing is also recorded as an animated PNG,
+or as a frame sequence if the file name has a % field ("frames/%05d.png"):
+
+    python render.py Branch -o tree.png --record tree_anim.png --frame-every 20
+
+With --profile, the render is profiled: a file name ending in .json saves a
+trace-event file (for chrome://tracing or Perfetto), anything else saves
+cProfile statistics:
+
+    python render.py Branch -p tree.json --profile tree.prof
+
+Plain renders are stored in a render cache, so a job whose parameters have
+been rendered before is copied from the cache instead of drawn again. The
+shapes drawn are cached too, as geometry, so a job which only changes the
+background or scale is painted from them without generating the drawing.
+The app uses the same cache folder; it draws on a transparent background, so
+it shares the geometry with render.py but not the images. Use --cache to
+pick the cache folder, or --no-cache. '''
+import os
+import sys
+import json
+import argparse
+import shutil
+from importlib import import_module
+from multiprocessing import get_context
+
+# draw on an off-screen platform, so no display is needed
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+from PySide2.QtGui import QGuiApplication, QColor
+from objects.surface import Surface
+from objects.export import make_export
+from objects.recorder import Recorder, RecordingSurface
+from objects.cache import RenderCache, DEFAULT_DIR
+from objects.geometry import GeometryTee, geometry_info
+
+def load_file(file_name):
+    ''' Loads a parameter or job file. YAML files need PyYAML installed; JSON
+    files need nothing extra. '''
+    with open(file_name) as f:
+        if file_name.lower().endswith((".yaml", ".yml")):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+def load_model(name, surface):
+    ''' Imports a model from the "objects" folder, creates an instance of it
+    drawing on the given surface, and sets its default parameters. '''
+    ModelClass = getattr(import_module("objects." + name.lower()), name)
+    model = ModelClass(surface)
+    model.set_params(model.defaults)
+    return model
+
+def render(job):
+    ''' Renders one job (a dictionary, as described at the top of this file)
+    and saves the image. Returns the output file name and an error message,
+    which is None if the render succeeded. '''
+    app = QGuiApplication.instance() or QGuiApplication([])
+    recorder = geometry = None
+    try:
+        bg_color = QColor(job.get("background", "white"))
+        w, h, scale = job.get("width", 1152), job.get("height", 648), job.get("scale", 1)
+        tiled = job.get("tiled") or job["output"].lower().endswith((".svg", ".geo"))
+        # a tiled render draws on its own tile surfaces; this one then only
+        # gives the model its canvas size
+        if job.get("record") and not tiled:
+            recorder = Recorder(job["record"], job.get("fps", 30), job.get("frame_every", 50))
+            surface = RecordingSurface(w, h, bg_color, recorder, scale = scale)
+        else:
+            surface = Surface(w, h, bg_color, scale = 1 if tiled else scale)
+        model = load_model(job["model"], surface)
+        model.set_params(job.get("params", {}))
+        cache = None
+        if job.get("cache") and not tiled and not job.get("record") and not job.get("profile"):
+            cache = RenderCache(job["cache"], job.get("cache_size", 1024 ** 3))
+            key = model.cache_key(w, h, bg_color, scale)
+            cached = cache.get_file(key)
+            if cached is not None and job["output"].lower().endswith(".png"):
+                shutil.copyfile(cached, job["output"])
+                return job["output"], None
+            geometry_key = model.geometry_key(w, h)
+            cached = cache.get_geometry(geometry_key)
+            if cached is not None: # paint the cached shapes instead
+                model = load_model("Geometry", surface)
+                model.set_params({"file_name": cached})
+            elif geometry_key is not None: # save the shapes while drawing
+                geometry = GeometryTee(surface, cache.temp_name(geometry_key, ".geo"), geometry_info(model))
+                model.canvas = geometry
+        if tiled:
+            make_export(model, w, h, job["output"], scale, bg_color).run()
+            return job["output"], None
+        if job.get("profile"):
+            for line in model.profile(job["profile"]):
+                print(line)
+            print("Profile saved as %s" % job["profile"])
+        else:
+            model.go()
+        if job.get("record"):
+            surface.finish()
+        surface.end()
+        if cache is not None:
+            cache.put(key, surface.image)
+        if geometry is not None:
+            geometry.close()
+            cache.put_geometry(geometry_key, geometry.file_name)
+            geometry = None
+        if not surface.image.save(job["output"]):
+            return job["output"], "could not save image"
+    except Exception as e:
+        return job.get("output"), "%s: %s" % (type(e).__name__, e)
+    finally:
+        # if the render failed before surface.finish(), the recording still
+        # has to be closed, or its writer thread and file stay open
+        if recorder is not None and recorder.thread.is_alive():
+            try:
+                recorder.close()
+            except Exception:
+                pass
+        if geometry is not None: # the render failed, so its shapes are not saved
+            geometry.discard()
+    return job["output"], None
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = "Render models to image files without a window.")
+    parser.add_argument("model", nargs = "?", help = "name of the model to render, e.g. Branch")
+    parser.add_argument("-p", "--params", help = "JSON or YAML file of model parameters")
+    parser.add_argument("-o", "--output", default = "render.png", help = "image file to save")
+    parser.add_argument("-j", "--jobs", help = "JSON or YAML file with a list of jobs to render")
+    parser.add_argument("--processes", type = int, default = None, help = "number of processes for a job file (default: one per CPU)")
+    # defaults match the canvas on a 1920 x 1080 screen
+    parser.add_argument("--width", type = int, default = 1152, help = "canvas width the model draws on")
+    parser.add_argument("--height", type = int, default = 648, help = "canvas height the model draws on")
+    parser.add_argument("--scale", type = float, default = 1, help = "image pixels per canvas unit")
+    parser.add_argument("--background", default = "white", help = "background color name or #RRGGBB")
+    parser.add_argument("--tiled", action = "store_true", help = "render in tiles with bounded memory (PNG or TIFF)")
+    parser.add_argument("--record", help = "also record the drawing as an animated PNG, or frames if the name has a %% field")
+    parser.add_argument("--fps", type = float, default = 30, help = "playback frames per second of the recording")
+    parser.add_argument("--frame-every", type = int, default = 50, help = "primitives drawn between recorded frames")
+    parser.add_argument("--profile", help = "save a profile of the render, as trace events (.json) or cProfile statistics")
+    parser.add_argument("--cache", default = DEFAULT_DIR, help = "render cache folder (default: %(default)s)")
+    parser.add_argument("--no-cache", dest = "cache", action = "store_const", const = None, help = "do not use the render cache")
+    args = parser.parse_args(argv)
+
+    defaults = {"width": args.width, "height": args.height,
+        "scale": args.scale, "background": args.background, "tiled": args.tiled,
+        "fps": args.fps, "frame_every": args.frame_every, "cache": args.cache}
+    if args.jobs:
+        jobs = [dict(defaults, **job) for job in load_file(args.jobs)]
+    elif args.model:
+        params = load_file(args.params) if args.params else {}
+        jobs = [dict(defaults, model = args.model, params = params, output = args.output, record = args.record, profile = args.profile)]
+    else:
+        parser.error("give a model name or a job file")
+
+    failed = 0
+    if len(jobs) == 1:
+        results = [render(jobs[0])]
+    else:
+        # spawn rather than fork, so each process starts Qt from scratch
+        pool = get_context("spawn").Pool(args.processes)
+        results = pool.imap_unordered(render, jobs, chunksize = 4)
+    for i, (file_name, error) in enumerate(results):
+        if error is None:
+            print("[%i/%i] Image saved as %s" % (i + 1, len(jobs), file_name))
+        else:
+            failed += 1
+            print("[%i/%i] Error rendering %s: %s" % (i + 1, len(jobs), file_name, error))
+    if len(jobs) > 1:
+        pool.close()
+        pool.join()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,90 @@
+''' Writes a small file in each format the app saves, and reads it back. '''
+import numpy as np
+import pytest
+from PySide2.QtGui import QImage
+from objects.geometry import GeometryWriter, Geometry, open_geometry, COLUMNS, LINE, CIRCLE
+from objects.export import PNGWriter, TIFFWriter
+from objects.recorder import APNGWriter
+
+Image = pytest.importorskip("PIL.Image")
+
+ROWS = [(LINE, 1, 2, 3, 4, 1.5, 0, 7), (CIRCLE, 5, 6, 5, 6, 2, 1, 3),
+    (LINE, 0, 0, 10, 10, 1, 2, 0), (CIRCLE, 8, 1, 8, 1, .5, 3, 255),
+    (LINE, 9, 9, 0, 0, 3, 4, 1)]
+
+def random_pixels(h, w):
+    return np.random.RandomState(0).randint(0, 256, (h, w, 3)).astype(np.uint8)
+
+def write_geometry(file_name, rows = ROWS):
+    info = {"model": "Branch", "params": {}, "cmap_name": "viridis", "cmap_size": 256, "w": 10, "h": 10}
+    writer = GeometryWriter(file_name, info, chunk_size = 2) # several chunks
+    for row in rows:
+        writer.add(*row)
+    writer.close()
+
+def test_geometry(tmp_path):
+    file_name = str(tmp_path / "shapes.geo")
+    write_geometry(file_name)
+    header, columns = open_geometry(file_name)
+    assert header["count"] == len(ROWS)
+    assert header["model"] == "Branch"
+    for i, (name, _) in enumerate(COLUMNS):
+        assert np.allclose(columns[name], [row[i] for row in ROWS])
+
+def test_empty_geometry(tmp_path):
+    file_name = str(tmp_path / "empty.geo")
+    write_geometry(file_name, [])
+    header, columns = open_geometry(file_name)
+    assert header["count"] == 0
+    assert all(len(column) == 0 for column in columns.values())
+
+def test_geometry_crop(tmp_path):
+    file_name = str(tmp_path / "shapes.geo")
+    write_geometry(file_name)
+    model = Geometry(None)
+    model.set_params(dict(Geometry.defaults, file_name = file_name, crop = [0, 0, 5, 5]))
+    for crop in ([0, 0, 0, 5], [0, 0, 5, -1], [0, 0, 5]):
+        with pytest.raises(ValueError):
+            model.set_params({"crop": crop})
+
+def test_png(tmp_path):
+    file_name = str(tmp_path / "image.png")
+    pixels = random_pixels(13, 7)
+    writer = PNGWriter(file_name, 7, 13)
+    writer.write_rows(pixels[:5]) # in bands, like a tiled export
+    writer.write_rows(pixels[5:])
+    writer.close()
+    assert np.array_equal(np.asarray(Image.open(file_name).convert("RGB")), pixels)
+
+def test_tiff(tmp_path):
+    file_name = str(tmp_path / "image.tif")
+    pixels = random_pixels(20, 37) # edge tiles are cut off
+    writer = TIFFWriter(file_name, 37, 20, 16)
+    for y in range(0, 20, 16):
+        for x in range(0, 37, 16):
+            writer.write_tile(pixels[y:y + 16, x:x + 16])
+    writer.close()
+    assert np.array_equal(np.asarray(Image.open(file_name).convert("RGB")), pixels)
+
+def to_image(pixels):
+    h, w = pixels.shape[:2]
+    # copy, so the image does not point into the bytes object
+    return QImage(pixels.tobytes(), w, h, w * 3, QImage.Format_RGB888).copy()
+
+def test_apng(tmp_path):
+    file_name = str(tmp_path / "anim.png")
+    frames = [np.full((6, 9, 3), 255, np.uint8)]
+    frames.append(frames[-1].copy())
+    frames[-1][1, 2] = (255, 0, 0)
+    frames.append(frames[-1].copy())
+    frames[-1][3:5, 4:8] = (0, 0, 255)
+    frames.append(frames[-1].copy()) # nothing changed
+    writer = APNGWriter(file_name, 30)
+    for pixels in frames:
+        writer.write(to_image(pixels))
+    writer.close()
+    apng = Image.open(file_name)
+    assert apng.n_frames == len(frames)
+    for i, pixels in enumerate(frames):
+        apng.seek(i)
+        assert np.array_equal(np.asarray(apng.convert("RGB")), pixels)